@@ -0,0 +1,114 @@
+import os
+import time
+import metrics
+
+# Environment Variable Keys
+_room_rate = "ROOM_RATE"
+_room_burst = "ROOM_BURST"
+_user_rate = "USER_RATE"
+_user_burst = "USER_BURST"
+
+# Admits a webhook message, in one round trip. KEYS: the message's idempotency
+# key, the room's token bucket, the user's token bucket. ARGV: now, room rate,
+# room burst, user rate, user burst, seconds to remember the message, and
+# whether the message can be deduplicated at all. A message already seen
+# returns {'duplicate', response}, where response is empty while the first
+# delivery is still being handled (one that fails is forgotten again). Otherwise a token is taken from both
+# buckets, or neither when either is empty.
+_admit_lua = """
+local dedupe = ARGV[7] == '1'
+if dedupe then
+    local seen = redis.call('GET', KEYS[1])
+    if seen then
+        return {'duplicate', seen}
+    end
+end
+
+local now = tonumber(ARGV[1])
+local function refill(key, rate, burst)
+    local bucket = redis.call('HMGET', key, 'tokens', 'at')
+    local tokens = tonumber(bucket[1]) or burst
+    local at = tonumber(bucket[2]) or now
+    return math.min(burst, tokens + math.max(0, now - at) * rate)
+end
+local function take(key, tokens, rate, burst)
+    redis.call('HSET', key, 'tokens', tostring(tokens - 1), 'at', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+
+local room_rate, room_burst = tonumber(ARGV[2]), tonumber(ARGV[3])
+local user_rate, user_burst = tonumber(ARGV[4]), tonumber(ARGV[5])
+local room = refill(KEYS[2], room_rate, room_burst)
+local user = refill(KEYS[3], user_rate, user_burst)
+if room < 1 or user < 1 then
+    return {'limited'}
+end
+take(KEYS[2], room, room_rate, room_burst)
+take(KEYS[3], user, user_rate, user_burst)
+if dedupe then
+    redis.call('SET', KEYS[1], '', 'EX', ARGV[6])
+end
+return {'admitted'}
+"""
+
+class Admission(object):
+    """ Decides, before any command runs, whether a webhook message is
+    handled at all. HipChat retries a webhook it did not get an answer to in
+    time, so every message is remembered by webhook id and message id: a
+    retry is answered with the response to the first delivery instead of
+    running the command again. Each room and each user in it also get a
+    token bucket, refilled at rate tokens a second up to burst, and a message
+    that finds either bucket empty is dropped.
+
+    All of a room's admission keys carry the room's hash tag, so they live on
+    the room's redis node.
+    """
+    message_key = "webhook:{{{0}}}:{1}:{2}"
+    room_bucket_key = "ratelimit:{{{0}}}"
+    user_bucket_key = "ratelimit:{{{0}}}:{1}"
+    room_rate = float(os.environ.get(_room_rate, 2))
+    room_burst = float(os.environ.get(_room_burst, 10))
+    user_rate = float(os.environ.get(_user_rate, 0.5))
+    user_burst = float(os.environ.get(_user_burst, 5))
+    remember_seconds = 300
+
+    def __init__(self, redis_client, time = time.time):
+        self.redis = redis_client
+        self.time = time
+
+    def admit(self, room_message):
+        """ Returns ("admitted", None), ("limited", None) or ("duplicate",
+        response), where response is the remembered response body, empty if
+        the first delivery has not been answered yet.
+        """
+        room_id = room_message.item.room.room_id
+        message_id = room_message.item.message.id
+        dedupe = room_message.webhook_id != None and message_id != None
+        keys = [self.message_key.format(room_id, room_message.webhook_id, message_id),
+                self.room_bucket_key.format(room_id),
+                self.user_bucket_key.format(room_id, room_message.item.message.user_from.id)]
+        args = [repr(self.time()), self.room_rate, self.room_burst, self.user_rate, self.user_burst,
+                self.remember_seconds, '1' if dedupe else '0']
+        result = self.redis.register_script(_admit_lua)(keys = keys, args = args)
+        decision = result[0].decode()
+        metrics.admissions.inc(result = decision)
+        if decision == "duplicate":
+            return decision, result[1].decode()
+        return decision, None
+
+    def remember(self, room_message, response):
+        """ Keeps the response body to an admitted message for its retries. """
+        if room_message.webhook_id == None or room_message.item.message.id == None:
+            return
+        key = self.message_key.format(room_message.item.room.room_id,
+                room_message.webhook_id, room_message.item.message.id)
+        self.redis.set(key, response, xx = True, ex = self.remember_seconds)
+
+    def forget(self, room_message):
+        """ Drops an admitted message whose handling failed, so that HipChat's
+        retry runs the command again instead of getting an empty response.
+        """
+        if room_message.webhook_id == None or room_message.item.message.id == None:
+            return
+        self.redis.delete(self.message_key.format(room_message.item.room.room_id,
+                room_message.webhook_id, room_message.item.message.id))
@@ -0,0 +1,240 @@
+import os
+
+# Trebek reads its settings when it is imported
+os.environ.setdefault("BOARD_LIMIT", "5")
+os.environ.setdefault("SECONDS_TO_EXPIRE", "60")
+os.environ.setdefault("ANSWER_MATCH_RATIO", "0.7")
+# admit every request, so the rate limits never cut the replay short
+os.environ.setdefault("ROOM_RATE", "1000000")
+os.environ.setdefault("ROOM_BURST", "1000000")
+os.environ.setdefault("USER_RATE", "1000000")
+os.environ.setdefault("USER_BURST", "1000000")
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+import bottle
+import entities
+import metrics
+import trebek
+
+# Replays a mix of webhook messages through the bottle app (index() and
+# Trebek.get_response_message) and reports latency, throughput and redis
+# command counts per command type, e.g.:
+#   python benchmark.py --requests 5000 --users 500 --months 36 --rooms 20
+#   python benchmark.py --redis-url redis://localhost:6379/15
+
+_default_mix = "jeopardy=2,answer=10,score=2,leaderboard=2,loserboard=1,lifetime_score=1,lifetime_leaderboard=1,lifetime_loserboard=1"
+
+_messages = {
+    "jeopardy": lambda: "jeopardy",
+    "answer": lambda: random.choice(["what is Let's Make a Deal", "what is the price is right", "Let's Make a Deal"]),
+    "score": lambda: "score",
+    "leaderboard": lambda: "leaderboard",
+    "loserboard": lambda: "loserboard",
+    "lifetime_score": lambda: "lifetime score",
+    "lifetime_leaderboard": lambda: "lifetime leaderboard",
+    "lifetime_loserboard": lambda: "lifetime loserboard"
+}
+
+class StubClueSource(object):
+    """ Serves copies of the test clue with increasing ids instead of calling jservice. """
+    def __init__(self):
+        with open('test-json-output.json') as json_data:
+            self.clue = json.load(json_data)
+        self.next_id = 0
+
+    def random_clues(self, count):
+        clues = []
+        for i in range(count):
+            self.next_id += 1
+            clue = dict(self.clue, id = self.next_id)
+            clues.append(entities.Question(**clue))
+        return clues
+
+class StubResponse(object):
+    status_code = 200
+
+    def json(self):
+        return {'invalid_count': 1}
+
+class StubHttp(object):
+    """ Stands in for the requests session used to talk to HipChat and jservice. """
+    def __init__(self):
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        return StubResponse()
+
+class CommandCounter(object):
+    def __init__(self):
+        self.commands = Counter()
+        self.round_trips = 0
+
+    def reset(self):
+        commands, round_trips = self.commands, self.round_trips
+        self.commands = Counter()
+        self.round_trips = 0
+        return commands, round_trips
+
+def count_commands(client, counter):
+    """ Wraps a redis client so every command, and every round trip (a single
+    command or a whole pipeline), is recorded in counter.
+    """
+    def record(commands, kind, seconds):
+        counter.commands.update(commands)
+        counter.round_trips += 1
+
+    return metrics.wrap_redis(client, record)
+
+def year_months(count):
+    now = datetime.now()
+    year, month = now.year, now.month
+    months = []
+    for i in range(count):
+        months.append("{0}-{1}".format(year, str(month).zfill(2)))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months
+
+def seed(r, users, months):
+    """ Gives every user a name and a score in each of the last months. """
+    names = dict((user_id, "User {0}".format(user_id)) for user_id in range(1, users + 1))
+    r.hset(trebek.Trebek.hipchat_users_key, mapping = names)
+
+    for month in year_months(months):
+        pipe = r.pipeline()
+        for user_id in range(1, users + 1):
+            score = random.randint(-20, 50) * 200
+            pipe.zincrby(trebek.Trebek.score_board_key.format(month), score, user_id)
+            pipe.zincrby(trebek.Trebek.lifetime_score_board_key, score, user_id)
+        pipe.execute()
+
+def post(app, payload):
+    body = json.dumps(payload).encode()
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.url_scheme': 'http',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80'
+    }
+    status = []
+    def start_response(status_line, headers, exc_info = None):
+        status.append(status_line)
+
+    body = b"".join(app(environ, start_response))
+    if not status[0].startswith("200"):
+        raise RuntimeError("{0}: {1}".format(status[0], environ['wsgi.errors'].getvalue()))
+    return body
+
+def parse_mix(mix):
+    weights = OrderedDict()
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        if name not in _messages:
+            raise ValueError("unknown command type {0}".format(name))
+        weights[name] = float(weight)
+    return weights
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+def run_benchmark(r, requests = 1000, mix = _default_mix, users = 100, months = 12, rooms = 5):
+    with open('test-room-message.json') as data:
+        template = json.load(data)
+
+    counter = CommandCounter()
+    seed(r, users, months)
+    trebek._redis = count_commands(r, counter)
+    trebek._room_router = None
+    trebek._http = StubHttp()
+    trebek._user_names.clear()
+    trebek.clue_source._default_source = StubClueSource()
+    app = bottle.default_app()
+
+    weights = parse_mix(mix)
+    results = dict((name, {'latency': [], 'commands': Counter(), 'round_trips': 0}) for name in weights)
+    counter.reset()
+    started = time.perf_counter()
+    for i in range(requests):
+        name = random.choices(list(weights.keys()), list(weights.values()))[0]
+        payload = json.loads(json.dumps(template))
+        payload['item']['room']['id'] = random.randint(1, rooms)
+        payload['item']['message']['id'] = str(i)
+        payload['item']['message']['from']['id'] = random.randint(1, users)
+        payload['item']['message']['from']['name'] = "User {0}".format(payload['item']['message']['from']['id'])
+        payload['item']['message']['message'] = "/trebek {0}".format(_messages[name]())
+
+        start = time.perf_counter()
+        post(app, payload)
+        results[name]['latency'].append(time.perf_counter() - start)
+        commands, round_trips = counter.reset()
+        results[name]['commands'].update(commands)
+        results[name]['round_trips'] += round_trips
+
+    return results, time.perf_counter() - started
+
+def report(results, elapsed):
+    total = sum(len(result['latency']) for result in results.values())
+    print("{0} requests in {1:.2f}s ({2:.1f} req/s)".format(total, elapsed, total / elapsed))
+    print("{0:<22}{1:>7}{2:>10}{3:>10}{4:>10}{5:>14}{6:>12}".format(
+        "command", "count", "p50 ms", "p95 ms", "p99 ms", "round trips", "commands"))
+    for name, result in results.items():
+        latency = result['latency']
+        if len(latency) == 0:
+            continue
+        print("{0:<22}{1:>7}{2:>10.3f}{3:>10.3f}{4:>10.3f}{5:>14.1f}{6:>12.1f}".format(name, len(latency),
+            percentile(latency, 50) * 1000, percentile(latency, 95) * 1000, percentile(latency, 99) * 1000,
+            result['round_trips'] / len(latency), sum(result['commands'].values()) / len(latency)))
+
+    print("")
+    print("redis commands per request:")
+    for name, result in results.items():
+        if len(result['latency']) == 0:
+            continue
+        commands = ", ".join("{0} {1:.1f}".format(command, count / len(result['latency']))
+                for command, count in result['commands'].most_common())
+        print("  {0}: {1}".format(name, commands))
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the hip-trebek webhook hot path")
+    parser.add_argument("--requests", type = int, default = 1000)
+    parser.add_argument("--mix", default = _default_mix,
+            help = "comma separated command=weight pairs, from: {0}".format(", ".join(_messages.keys())))
+    parser.add_argument("--users", type = int, default = 100)
+    parser.add_argument("--months", type = int, default = 12, help = "months of score history to seed")
+    parser.add_argument("--rooms", type = int, default = 5)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--redis-url", help = "benchmark a real redis instead of fakeredis; the database is flushed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ[trebek._unit_test] = "true" # no expiration scheduler or clue pool threads
+    if args.redis_url:
+        import redis
+        r = redis.StrictRedis.from_url(args.redis_url)
+    else:
+        import fakeredis
+        r = fakeredis.FakeStrictRedis()
+    r.flushdb()
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results, elapsed = run_benchmark(r, args.requests, args.mix, args.users, args.months, args.rooms)
+        report(results, elapsed)
+    finally:
+        r.flushdb()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache(object):
+    """ A small thread-safe least-recently-used cache for in-process lookups.
+    When ttl is given, entries expire ttl seconds after they were set.
+    """
+    def __init__(self, max_size, ttl = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry == None:
+                return default
+            value, expires = entry
+            if expires != None and expires < time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl == None else time.time() + self.ttl
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,74 @@
+import random
+import re
+import entities
+
+_punctuation = re.compile(r'[^\w\s]')
+_article = re.compile(r'^(the|a|an) ')
+_whitespace = re.compile(r'\s+')
+
+# Picks a random clue id from an index set and returns the stored clue.
+# KEYS: the clue hash, the index set.
+_random_clue_lua = """
+local id = redis.call('SRANDMEMBER', KEYS[2])
+if not id then
+    return false
+end
+return redis.call('HGET', KEYS[1], id)
+"""
+
+def normalize_category(title):
+    """ "The Bible", "THE BIBLE" and "bible!" all index as "bible". """
+    title = _punctuation.sub("", title.lower())
+    title = _whitespace.sub(" ", title).strip()
+    return _article.sub("", title)
+
+class ClueIndex(object):
+    """ An inverted index, in redis, over every valid clue the bot has seen:
+    one set of clue ids per normalized category title, per value and per
+    airdate decade, next to a hash of the clues themselves in their compact
+    encoding. Clues are added as they are ingested, so a themed round is one
+    random pick from a set instead of a search through the clue source.
+    """
+    clues_key = "clueIndex:clues"
+    category_key = "clueIndex:category:{0}"
+    value_key = "clueIndex:value:{0}"
+    decade_key = "clueIndex:decade:{0}"
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def add(self, clues, pipe = None):
+        """ Indexes clues, on pipe when given (the caller executes it). """
+        own_pipe = pipe == None
+        if own_pipe:
+            pipe = self.redis.pipeline()
+        for clue in clues:
+            pipe.hset(self.clues_key, clue.id, entities.encode_clue(clue))
+            pipe.sadd(self.category_key.format(normalize_category(clue.category.title)), clue.id)
+            pipe.sadd(self.value_key.format(clue.value), clue.id)
+            pipe.sadd(self.decade_key.format(clue.airdate.year // 10 * 10), clue.id)
+        if own_pipe:
+            pipe.execute()
+
+    def random_clue(self, category = None, value = None, decade = None):
+        """ Returns a random indexed clue matching every criterion given, or
+        None. A single criterion is one round trip; several are intersected
+        first.
+        """
+        keys = []
+        if category != None:
+            keys.append(self.category_key.format(normalize_category(category)))
+        if value != None:
+            keys.append(self.value_key.format(value))
+        if decade != None:
+            keys.append(self.decade_key.format(decade))
+        if len(keys) == 0:
+            raise ValueError("random_clue needs a category, value or decade")
+
+        if len(keys) == 1:
+            script = self.redis.register_script(_random_clue_lua)
+            o = script(keys = [self.clues_key] + keys)
+        else:
+            ids = list(self.redis.sinter(keys))
+            o = self.redis.hget(self.clues_key, random.choice(ids)) if len(ids) > 0 else None
+        return entities.decode_clue(o) if o != None else None
@@ -0,0 +1,133 @@
+import csv
+import json
+import mmap
+import os
+import random
+import struct
+import requests
+import entities
+
+# Environment Variable Keys
+_clue_source = "CLUE_SOURCE"
+_clue_corpus_path = "CLUE_CORPUS_PATH"
+
+# Corpus file layout:
+#   header: magic, format version, number of clues
+#   offset table: one fixed-size record per clue (offset, length, category id, value)
+#   data: the UTF-8 JSON record of every clue (already cleaned, see
+#         Question.from_record), back to back
+_corpus_magic = b"TRBK"
+_corpus_version = 2
+_header = struct.Struct("<4sHI")
+_record = struct.Struct("<QIIH")
+
+_default_source = None
+
+def is_valid_clue(clue):
+    valid = clue.invalid_count == None and clue.question.strip() != ""
+    if valid:
+        valid = "seen here" not in clue.question.lower()
+
+    if valid:
+        valid = "heard here" not in clue.question.lower()
+
+    return valid
+
+def get_clue_source(http = None):
+    """ Returns the process-wide clue source selected by CLUE_SOURCE
+    ("jservice", the default, or "corpus"). A jservice source fetches over
+    http, the requests session it is first created with.
+    """
+    global _default_source
+    if _default_source == None:
+        if os.environ.get(_clue_source, "jservice") == "corpus":
+            path = os.environ.get(_clue_corpus_path)
+            if path == None:
+                raise ValueError("CLUE_SOURCE=corpus needs CLUE_CORPUS_PATH, the corpus built with build-corpus")
+            _default_source = CorpusClueSource(path)
+        else:
+            _default_source = JServiceClueSource(http)
+    return _default_source
+
+class JServiceClueSource(object):
+    url = "http://jservice.io/api/random?count={0}"
+
+    def __init__(self, http = None):
+        self.http = http if http != None else requests.Session()
+
+    def random_clues(self, count):
+        # jservice caps a single random request at 100 clues
+        req = self.http.get(self.url.format(min(count, 100)), timeout = 5)
+        return [entities.Question(**c) for c in req.json()]
+
+class CorpusClueSource(object):
+    """ Serves clues from a local corpus file built with build_corpus. The file
+    is memory-mapped, so picking a clue is one random read from the offset
+    table plus the clue itself; invalid clues were dropped when the corpus was
+    built.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.corpus = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, self.count = _header.unpack_from(self.corpus, 0)
+        if magic != _corpus_magic or version != _corpus_version:
+            raise ValueError("{0} is not a version {1} clue corpus".format(path, _corpus_version))
+
+    def read_record(self, index):
+        return _record.unpack_from(self.corpus, _header.size + index * _record.size)
+
+    def read_clue(self, index):
+        offset, length, category_id, value = self.read_record(index)
+        return entities.Question.from_record(json.loads(self.corpus[offset:offset + length].decode()))
+
+    def random_clues(self, count):
+        if self.count == 0:
+            return []
+        return [self.read_clue(random.randrange(self.count)) for i in range(count)]
+
+def load_dump(path):
+    """ Loads clue dictionaries from a jservice style JSON dump (a list of
+    clues), or from a CSV with the columns id, answer, question, value,
+    airdate, category_id and category_title.
+    """
+    with open(path, encoding = 'utf-8') as f:
+        if not path.lower().endswith('.csv'):
+            return json.load(f)
+
+        clues = []
+        for i, row in enumerate(csv.DictReader(f)):
+            clues.append({
+                'id': int(row.get('id') or i + 1),
+                'answer': row['answer'],
+                'question': row['question'],
+                'value': int(row['value']) if row.get('value') else None,
+                'airdate': row.get('airdate') or None,
+                'category_id': int(row.get('category_id') or 0),
+                'category': {'id': int(row.get('category_id') or 0), 'title': row['category_title'],
+                    'created_at': None, 'updated_at': None, 'clues_count': None}
+            })
+        return clues
+
+def build_corpus(clues, path):
+    """ Writes the given clue dictionaries to a corpus file for
+    CorpusClueSource, dropping any clue that fails is_valid_clue. Returns the
+    number of clues written.
+    """
+    records = []
+    data = []
+    offset = 0
+    valid = [q for q in (entities.Question(**c) for c in clues) if is_valid_clue(q)]
+    data_start = _header.size + len(valid) * _record.size
+    for question in valid:
+        encoded = json.dumps(question, cls = entities.QuestionEncoder).encode()
+        records.append(_record.pack(data_start + offset, len(encoded),
+            question.category.id or 0, question.value or 0))
+        data.append(encoded)
+        offset += len(encoded)
+
+    with open(path, 'wb') as f:
+        f.write(_header.pack(_corpus_magic, _corpus_version, len(valid)))
+        f.writelines(records)
+        f.writelines(data)
+
+    return len(valid)
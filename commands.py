@@ -0,0 +1,49 @@
+import re
+
+_named_group = re.compile(r'\(\?P<\w+>')
+
+class CommandRouter(object):
+    """ Maps messages to command handlers with a single match against one
+    alternation of every pattern, tried in registration order. Named groups
+    that match are passed to the handler as keyword arguments.
+    """
+    def __init__(self):
+        self.commands = []
+        self.default = None
+        self.pattern = None
+
+    def register(self, pattern, handler, **kwargs):
+        arguments = re.compile(pattern) if "(?P<" in pattern else None
+        self.commands.append((pattern, handler.__name__, kwargs, arguments))
+        self.pattern = None
+
+    def command(self, pattern, **kwargs):
+        def decorator(handler):
+            self.register(pattern, handler, **kwargs)
+            return handler
+        return decorator
+
+    def default_command(self, handler):
+        self.default = handler.__name__
+        return handler
+
+    def compile(self):
+        self.pattern = re.compile("|".join("(?P<command{0}>{1})".format(i, _named_group.sub("(?:", pattern))
+            for i, (pattern, handler, kwargs, arguments) in enumerate(self.commands)))
+
+    def route(self, message):
+        """ Returns the name of the handler for message and the keyword
+        arguments to call it with.
+        """
+        if self.pattern == None:
+            self.compile()
+
+        match = self.pattern.match(message)
+        if match == None:
+            return self.default, {}
+
+        pattern, handler, kwargs, arguments = self.commands[int(match.lastgroup[len("command"):])]
+        if arguments != None:
+            groups = arguments.match(message).groupdict()
+            kwargs = dict(kwargs, **dict((name, value) for name, value in groups.items() if value != None))
+        return handler, kwargs
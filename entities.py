@@ -1,19 +1,25 @@
-import re 
 import bs4
 import json
 from datetime import datetime
 from dateutil import parser
 
+_first_airdate = "9/10/1984" # First airdate of Jeopardy!
+_clue_format_version = 1
+
 class HipChatUser(object):
+    __slots__ = ('id', 'name')
+
     def __init__(self, id = None, name = None, created = None,
             email = None, group = None, is_deleted = None, is_group_admin = None,
             is_guest = None, last_active = None, links = None, mention_name = None,
-            photo_url = None, presence = None, timezone = None, title = None, 
+            photo_url = None, presence = None, timezone = None, title = None,
             version = None, xmpp_jid = None):
         self.id = id
         self.name = name
 
 class Category(object):
+    __slots__ = ('id', 'title', 'created_at', 'updated_at', 'clues_count')
+
     def __init__(self, id, title, created_at, updated_at, clues_count):
         self.id = id
         self.title = title
@@ -21,19 +27,31 @@ class Category(object):
         self.updated_at = updated_at
         self.clues_count = clues_count
 
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
 class Question(object):
-    def __init__(self, id, answer = None, question = None, airdate = None, created_at = None, 
+    """ A clue. The constructor is the ingestion path for raw jservice clues:
+    it strips HTML from the answer and fills in the defaults. Clues read back
+    from redis or the corpus have already been through it and are rehydrated
+    with from_record, which only copies fields.
+    """
+    __slots__ = ('id', 'answer', 'question', 'value', '_airdate', 'created_at', 'updated_at',
+            'category_id', 'game_id', 'invalid_count', 'category', 'expiration')
+
+    def __init__(self, id, answer = None, question = None, airdate = None, created_at = None,
         updated_at = None, category_id = None, game_id = None, invalid_count = None, category = None,
         value = 200, expiration = None):
         self.id = id
-        soup = bs4.BeautifulSoup(answer, "html.parser")
-        self.answer = soup.get_text().replace('\\', '')
+        if '<' in answer or '&' in answer:
+            answer = bs4.BeautifulSoup(answer, "html.parser").get_text()
+        self.answer = answer.replace('\\', '')
         self.question = question
         if value is None or value == "":
             value = 200
         self.value = value
         if airdate == None:
-            airdate = "9/10/1984" # First airdate of Jeopardy!
+            airdate = _first_airdate
         self.airdate = parser.parse(airdate)
         self.created_at = created_at
         self.updated_at = updated_at
@@ -43,39 +61,101 @@ class Question(object):
         self.category = Category(**category)
         self.expiration = expiration
 
+    @property
+    def airdate(self):
+        # rehydrated clues keep the stored ISO string until the date is needed
+        if not isinstance(self._airdate, datetime):
+            self._airdate = parser.parse(self._airdate or _first_airdate)
+        return self._airdate
+
+    @airdate.setter
+    def airdate(self, value):
+        self._airdate = value
+
+    @classmethod
+    def from_record(cls, record):
+        question = cls.__new__(cls)
+        for field in cls.__slots__:
+            setattr(question, field, record.get(field.lstrip('_')))
+        question.category = Category(**record['category'])
+        return question
+
+    def to_dict(self):
+        record = dict((field.lstrip('_'), getattr(self, field)) for field in self.__slots__)
+        record['category'] = self.category.to_dict()
+        return record
+
 class QuestionEncoder(json.JSONEncoder):
     def default(self, obj):
-        # if not isinstance(obj, Question):
-        #     return super(QuestionEncoder, self).default(obj)
-        # elif not isinstance(obj, Category):
-        #     return super(QuestionEncoder, self).default(obj)
-
         if isinstance(obj, datetime):
             return obj.isoformat()
 
-        return obj.__dict__
+        return obj.to_dict()
+
+def encode_clue(question):
+    """ Compact encoding for the clues the game keeps in redis: a versioned
+    array of only the fields it uses (id, answer, question, value, category
+    title, airdate and expiration).
+    """
+    airdate = question._airdate
+    if isinstance(airdate, datetime):
+        airdate = airdate.isoformat()
+    return json.dumps([_clue_format_version, question.id, question.answer, question.question,
+        question.value, question.category.title, airdate, question.expiration],
+        separators = (',', ':'))
+
+def decode_clue(encoded):
+    """ Decodes a clue written by encode_clue. Clues written as a full
+    QuestionEncoder JSON object, before the compact format, are still read.
+    """
+    if isinstance(encoded, bytes):
+        encoded = encoded.decode()
+    record = json.loads(encoded)
+    if isinstance(record, dict):
+        return Question.from_record(record)
+    if record[0] != _clue_format_version:
+        raise ValueError("unknown clue format version {0}".format(record[0]))
+
+    question = Question.__new__(Question)
+    (version, question.id, question.answer, question.question, question.value,
+        title, question._airdate, question.expiration) = record
+    question.created_at = question.updated_at = None
+    question.category_id = question.game_id = question.invalid_count = None
+    question.category = Category(None, title, None, None, None)
+    return question
 
 class HipChatFromUser(object):
+    __slots__ = ('id', 'name')
+
     def __init__(self, from_user):
         self.id = from_user["id"]
         self.name = from_user["name"]
 
 class HipChatMessage(object):
+    __slots__ = ('id', 'user_from', 'message')
+
     def __init__(self, jsonDict):
+        self.id = jsonDict.get("id")
         self.user_from = HipChatFromUser(jsonDict["from"])
-        self.message = re.sub('/trebek ', '', jsonDict["message"])
+        self.message = jsonDict["message"].replace('/trebek ', '')
 
 class HipChatRoom(object):
+    __slots__ = ('room_id', 'links')
+
     def __init__(self, roomDict):
         self.room_id = roomDict["id"]
         self.links = roomDict["links"]
 
 class HipChatMessageItem(object):
+    __slots__ = ('message', 'room')
+
     def __init__(self, message = None, room = None):
         self.message = HipChatMessage(message)
         self.room = HipChatRoom(room)
 
 class HipChatRoomMessage(object):
+    __slots__ = ('event', 'item', 'oauth_client_id', 'webhook_id')
+
     def __init__(self, event = None, item = None, oauth_client_id = None, webhook_id = None):
         self.event = event
         self.item = HipChatMessageItem(**item)
@@ -84,6 +164,3 @@ class HipChatRoomMessage(object):
 
     def __repr__(self):
         return self.item.message.message
-
-
-
@@ -1,7 +1,24 @@
+import os
+
+# WEB_SERVER=gevent serves every request as a greenlet on a single event loop,
+# so one dyno can handle many busy rooms without a thread per request. The
+# monkey patching has to happen before redis and requests are imported so
+# that their sockets become cooperative.
+_web_server = os.environ.get('WEB_SERVER', 'paste')
+if _web_server == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+import logging
 from bottle import run
 import trebek
-import os
-import paste
+
+logging.basicConfig(level = os.environ.get('LOG_LEVEL', 'INFO'),
+        format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 if __name__ == "__main__":
-    run(server='paste', host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+    # pick up answer expirations left pending by the previous dyno
+    trebek.get_scheduler().start()
+    # and deliver any HipChat messages still queued
+    trebek.get_outbox()
+    run(server=_web_server, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,41 @@
+import logging
+import threading
+import time
+import metrics
+
+class RateLimitFilter(logging.Filter):
+    """ Lets through at most burst records for each message (by logger and
+    format string, before its arguments are filled in) every interval
+    seconds, so that a failure repeated on every request cannot flood the
+    log. Dropped records are counted in the trebek_log_messages_suppressed_total
+    metric.
+    """
+    def __init__(self, interval = 60, burst = 10):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.time()
+        with self.lock:
+            started, count = self.windows.get(key, (now, 0))
+            if now - started >= self.interval:
+                started, count = now, 0
+            self.windows[key] = (started, count + 1)
+
+        if count < self.burst:
+            return True
+        metrics.log_suppressed.inc(logger = record.name)
+        return False
+
+_rate_limit = RateLimitFilter()
+
+def get_logger(name):
+    """ Returns the named logger with the shared rate limit applied. """
+    logger = logging.getLogger(name)
+    if _rate_limit not in logger.filters:
+        logger.addFilter(_rate_limit)
+    return logger
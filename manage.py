@@ -0,0 +1,54 @@
+import argparse
+import trebek
+import clue_source
+
+# Maintenance commands, run against the production redis with e.g.:
+#   heroku run python manage.py migrate-scores
+
+def migrate_scores(args):
+    migrated = trebek.migrate_user_scores(trebek.get_redis())
+    print("Migrated {0} score keys".format(migrated))
+
+def migrate_user_names(args):
+    migrated = trebek.migrate_user_names(trebek.get_redis())
+    print("Migrated {0} user names".format(migrated))
+
+def rollup_scores(args):
+    months = trebek.rollup_scores(trebek.get_redis(), summary = not args.no_summary)
+    print("Rolled up {0} closed months{1}".format(len(months),
+        ": " + ", ".join(months) if len(months) > 0 else ""))
+
+def build_corpus(args):
+    written = clue_source.build_corpus(clue_source.load_dump(args.dump), args.corpus)
+    print("Wrote {0} clues to {1}".format(written, args.corpus))
+
+def main():
+    parser = argparse.ArgumentParser(description = "hip-trebek maintenance commands")
+    commands = parser.add_subparsers(dest = "command")
+    commands.required = True
+
+    migrate = commands.add_parser("migrate-scores",
+            help = "fold the legacy per-user score keys into the sorted set leaderboards")
+    migrate.set_defaults(func = migrate_scores)
+
+    names = commands.add_parser("migrate-user-names",
+            help = "move the legacy per-user name keys into the user name hash")
+    names.set_defaults(func = migrate_user_names)
+
+    rollup = commands.add_parser("rollup-scores",
+            help = "compact the monthly boards of closed months into score summaries")
+    rollup.add_argument("--no-summary", action = "store_true",
+            help = "drop closed monthly boards without keeping a summary")
+    rollup.set_defaults(func = rollup_scores)
+
+    corpus = commands.add_parser("build-corpus",
+            help = "build an offline clue corpus (for CLUE_SOURCE=corpus) from a JSON or CSV dump")
+    corpus.add_argument("dump")
+    corpus.add_argument("corpus")
+    corpus.set_defaults(func = build_corpus)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import re
+import difflib
+import cache
+from collections import Counter, OrderedDict
+
+_punctuation = re.compile(r'[^\w\s]')
+_expected_article = re.compile(r'^(the|a|an|or) ', re.I)
+_ampersand = re.compile(r'\s+(&nbsp;|&)\s+', re.I)
+_question_word = re.compile(r'^(what|whats|where|wheres|who|whos) ', re.I)
+_verb = re.compile(r'^(is|are|was|were) ', re.I)
+_article = re.compile(r'^(the|a|an) ', re.I)
+_parenthetical = re.compile(r"(.*)(\(.+\))(.*)")
+
+# Environment Variable Keys
+_answer_similarity = "ANSWER_SIMILARITY"
+
+_matchers = cache.LRUCache(256)
+
+def clean_expected_answer(expected):
+    expected = _punctuation.sub("", expected)
+    expected = _expected_article.sub("", expected)
+    return expected.strip().lower()
+
+def clean_user_answer(actual):
+    actual = _ampersand.sub(" and ", actual)
+    actual = _punctuation.sub("", actual)
+    actual = _question_word.sub("", actual)
+    actual = _verb.sub("", actual)
+    actual = _article.sub("", actual)
+    return actual.strip().lower()
+
+def sequence_matcher_similar(expected, actual, ratio):
+    return difflib.SequenceMatcher(a = expected, b = actual).ratio() >= ratio
+
+def edit_distance_similar(expected, actual, ratio):
+    """ Scores by the insert/delete edit distance between the answers, which
+    works out to longest-common-subsequence similarity, and gives up as soon
+    as ratio can no longer be reached. It is faster than difflib but looser:
+    difflib only counts greedily matched blocks, so at 0.5 this accepts
+    "london" for "boston" where difflib does not.
+    """
+    total = len(expected) + len(actual)
+    if total == 0:
+        return True
+
+    limit = int((1 - ratio) * total + 1e-9)
+    if abs(len(expected) - len(actual)) > limit:
+        return False
+
+    # every insert or delete changes one character count by one, so the
+    # difference between the character histograms is a lower bound
+    counts = Counter(expected)
+    counts.subtract(actual)
+    if sum(abs(count) for count in counts.values()) > limit:
+        return False
+
+    return bounded_edit_distance(expected, actual, limit) <= limit
+
+def bounded_edit_distance(a, b, limit):
+    """ Insert/delete edit distance between a and b, or limit + 1 once it is
+    known to be over limit. Only the diagonal band of width limit is filled
+    in, and the search stops early once a whole row is over the limit.
+    """
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            if a[i - 1] == b[j - 1]:
+                distance = previous[j - 1]
+            else:
+                distance = 1 + min(previous[j], current[j - 1])
+            current[j] = min(distance, over)
+
+        if min(current) > limit:
+            return over
+        previous = current
+
+    return previous[len(b)]
+
+similarity_backends = {
+    "difflib": sequence_matcher_similar,
+    "edit_distance": edit_distance_similar
+}
+
+def get_similarity(name = None):
+    """ Returns the similarity backend named by ANSWER_SIMILARITY; a backend
+    is called as backend(expected, actual, ratio) and returns a bool.
+    """
+    if name == None:
+        name = os.environ.get(_answer_similarity, "difflib")
+    return similarity_backends[name]
+
+class AnswerMatcher(object):
+    """ The normalized forms a clue's answer can be given in, worked out once
+    per clue rather than on every guess. Besides the answer itself, an answer
+    with a parenthetical also accepts the "(or ...)" alternate and the answer
+    with the parenthetical left out; see the unit tests for examples.
+    """
+    def __init__(self, expected):
+        self.expected = expected
+        forms = [clean_expected_answer(expected)]
+        parens_group = _parenthetical.match(expected)
+        if parens_group:
+            if "or" in parens_group.group(2):
+                forms.append(clean_expected_answer(parens_group.group(2)))
+            forms.append(clean_expected_answer(expected.replace(parens_group.group(2), "")))
+
+        self.forms = tuple(OrderedDict.fromkeys(forms))
+
+    def matches(self, actual, compare):
+        """ Normalizes the user's answer once and checks it against every
+        accepted form with compare(expected, actual).
+        """
+        actual = clean_user_answer(actual)
+        if actual in self.forms:
+            return True
+        return any(compare(form, actual) for form in self.forms)
+
+def get_matcher(expected):
+    """ Returns the cached AnswerMatcher for an expected answer, building it
+    the first time the answer is seen.
+    """
+    matcher = _matchers.get(expected)
+    if matcher == None:
+        matcher = AnswerMatcher(expected)
+        _matchers.set(expected, matcher)
+    return matcher
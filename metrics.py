@@ -0,0 +1,172 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Latency buckets, in seconds, from a cached redis read to a slow jservice call.
+_default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _format_labels(labels, extra = ()):
+    pairs = list(labels) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in pairs) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in sorted(self.values.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+class Histogram(object):
+    """ Counts observations into cumulative latency buckets, as Prometheus
+    histograms do, along with their sum and count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets = _default_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts == None:
+                # one count per bucket, then +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                samples.append((self.name + "_bucket", labels + (("le", bound),), total))
+            samples.append((self.name + "_sum", labels, counts[-1]))
+            samples.append((self.name + "_count", labels, total))
+        return samples
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help, buckets = _default_buckets):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        """ Every metric in the Prometheus text exposition format. """
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {0} {1}".format(metric.name, metric.help))
+            lines.append("# TYPE {0} {1}".format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append("{0}{1} {2}".format(name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+command_seconds = registry.histogram("trebek_command_seconds", "Time spent in each command handler.")
+redis_seconds = registry.histogram("trebek_redis_round_trip_seconds",
+        "Time spent in each redis round trip, a single command or a whole pipeline.")
+redis_commands = registry.counter("trebek_redis_commands_total", "Redis commands sent, by command.")
+clue_fetch_seconds = registry.histogram("trebek_clue_fetch_seconds", "Time spent fetching clues from the clue source.")
+match_seconds = registry.histogram("trebek_answer_match_seconds", "Time spent on each fuzzy answer comparison.")
+log_suppressed = registry.counter("trebek_log_messages_suppressed_total", "Log messages dropped by the rate limit.")
+admissions = registry.counter("trebek_admissions_total",
+        "Webhook messages by admission decision: admitted, limited or duplicate.")
+outbox_gauge = registry.gauge("trebek_outbox", "HipChat outbox queue depth, delivery counts and latency.")
+
+def wrap_redis(client, record):
+    """ Wraps a redis client so that every round trip, a single command or a
+    whole pipeline, is passed to record(commands, kind, seconds) once it is
+    done, with the upper-cased names of the commands it sent.
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def recorded_execute_command(*args, **options):
+        start = time.perf_counter()
+        try:
+            return execute_command(*args, **options)
+        finally:
+            record([str(args[0]).upper()], "command", time.perf_counter() - start)
+
+    def recorded_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def recorded_execute(*args, **kwargs):
+            commands = [str(command_args[0]).upper() for command_args, options in pipe.command_stack]
+            start = time.perf_counter()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                record(commands, "pipeline", time.perf_counter() - start)
+
+        pipe.execute = recorded_execute
+        return pipe
+
+    client.execute_command = recorded_execute_command
+    client.pipeline = recorded_pipeline
+    return client
+
+def instrument_redis(client):
+    """ Wraps a redis client so that every round trip is timed and every
+    command counted.
+    """
+    def record(commands, kind, seconds):
+        for command in commands:
+            redis_commands.inc(command = command)
+        redis_seconds.observe(seconds, kind = kind)
+
+    return wrap_redis(client, record)
@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+import uuid
+import requests
+import logs
+
+_log = logs.get_logger("trebek.outbox")
+
+# Queues a message unless the outbox already holds max depth of them.
+# KEYS: queue. ARGV: message, max depth.
+_enqueue_lua = """
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+return redis.call('RPUSH', KEYS[1], ARGV[1])
+"""
+
+class Outbox(object):
+    """ Delivers messages to HipChat rooms from a redis-backed queue, so that
+    callers never wait on HipChat themselves. A pool of worker threads drains
+    the queue over one keep-alive session; messages for the same room that are
+    waiting together are sent as one post.
+
+    A failed delivery is retried with exponential backoff through the retry
+    sorted set, and given up after max_attempts. When HipChat reports that a
+    room's rate limit is used up (a 429, or X-Ratelimit-Remaining of 0), the
+    room is throttled until X-Ratelimit-Reset and its messages wait until
+    then. Past max_depth queued messages, send refuses new ones rather than
+    letting the queue grow without bound.
+    """
+    queue_key = "outbox"
+    retry_key = "outbox:retry"
+    throttle_key = "outbox:throttle:{0}"
+
+    def __init__(self, redis_client, http, url, workers = 2, batch_size = 10,
+            max_depth = 1000, max_attempts = 5, backoff = 1.0, poll_interval = 1):
+        self.redis = redis_client
+        self.http = http
+        self.url = url
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.threads = []
+        self.lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def send(self, room_id, message, color = 'gray'):
+        """ Queues message for room_id. Returns False when the queue is full. """
+        entry = json.dumps({'id': uuid.uuid4().hex, 'room_id': room_id, 'message': message,
+            'color': color, 'queued': time.time(), 'attempts': 0})
+        script = self.redis.register_script(_enqueue_lua)
+        if not script(keys = [self.queue_key], args = [entry, self.max_depth]):
+            with self.lock:
+                self.rejected += 1
+            _log.warning("outbox is full, dropping message for room %s", room_id)
+            return False
+        return True
+
+    def start(self):
+        with self.lock:
+            if len(self.threads) > 0:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target = self.run, daemon = True)
+                thread.start()
+                self.threads.append(thread)
+
+    def run(self):
+        while True:
+            try:
+                self.work_once(block = True)
+            except Exception as e:
+                _log.exception("outbox worker failed: %s", e)
+                time.sleep(self.poll_interval)
+
+    def work_once(self, block = False):
+        """ Moves any retries that are due back onto the queue, then takes up
+        to batch_size messages and delivers them, one post per room. Returns
+        the number of messages taken.
+        """
+        self.requeue_due()
+        entries = self.take(block)
+        rooms = {}
+        for entry in entries:
+            rooms.setdefault(entry['room_id'], []).append(entry)
+        for room_id, batch in rooms.items():
+            self.deliver(room_id, batch)
+        return len(entries)
+
+    def take(self, block = False):
+        entries = []
+        if block:
+            first = self.redis.blpop(self.queue_key, timeout = self.poll_interval)
+            if first == None:
+                return entries
+            entries.append(first[1])
+
+        pipe = self.redis.pipeline()
+        pipe.lrange(self.queue_key, 0, self.batch_size - len(entries) - 1)
+        pipe.ltrim(self.queue_key, self.batch_size - len(entries), -1)
+        entries += pipe.execute()[0]
+        return [json.loads(entry.decode()) for entry in entries]
+
+    def requeue_due(self):
+        for member in self.redis.zrangebyscore(self.retry_key, 0, time.time()):
+            # claimed with ZREM so that only one worker requeues it
+            if self.redis.zrem(self.retry_key, member):
+                self.redis.rpush(self.queue_key, member)
+
+    def deliver(self, room_id, batch):
+        throttled = self.redis.pttl(self.throttle_key.format(room_id))
+        if throttled != None and throttled > 0:
+            self.defer(batch, time.time() + throttled / 1000.0)
+            return
+
+        parameters = {}
+        parameters['message'] = "<br/>".join(entry['message'] for entry in batch)
+        parameters['room_id'] = room_id
+        parameters['color'] = batch[0]['color']
+        parameters['from'] = 'Trebek'
+        try:
+            resp = self.http.post(self.url, data = parameters, timeout = 5)
+        except requests.RequestException as e:
+            _log.warning("failed to post message to hipchat: %s", e)
+            self.retry(batch)
+            return
+
+        reset = self.rate_limit_reset(resp)
+        if reset != None:
+            self.redis.set(self.throttle_key.format(room_id), 'true',
+                    px = max(1, int((reset - time.time()) * 1000)))
+        if resp.status_code == 429:
+            self.defer(batch, reset if reset != None else time.time() + self.backoff)
+        elif resp.status_code >= 300:
+            _log.warning("failed to post message to hipchat: %s", resp.status_code)
+            self.retry(batch)
+        else:
+            now = time.time()
+            with self.lock:
+                for entry in batch:
+                    latency = now - entry['queued']
+                    self.delivered += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+
+    def rate_limit_reset(self, resp):
+        """ Returns when the room's rate limit resets, when the response says
+        it is used up, or None.
+        """
+        remaining = resp.headers.get('X-Ratelimit-Remaining')
+        reset = resp.headers.get('X-Ratelimit-Reset')
+        if resp.status_code != 429 and remaining != '0':
+            return None
+        if reset == None:
+            return None
+        return float(reset)
+
+    def retry(self, batch):
+        retries = {}
+        for entry in batch:
+            entry['attempts'] += 1
+            if entry['attempts'] >= self.max_attempts:
+                with self.lock:
+                    self.failed += 1
+                _log.error("giving up on message for room %s", entry['room_id'])
+            else:
+                due = time.time() + self.backoff * 2 ** (entry['attempts'] - 1)
+                retries[json.dumps(entry)] = due
+        if len(retries) > 0:
+            with self.lock:
+                self.retried += len(retries)
+            self.redis.zadd(self.retry_key, retries)
+
+    def defer(self, batch, due):
+        self.redis.zadd(self.retry_key, dict((json.dumps(entry), due) for entry in batch))
+
+    def stats(self):
+        """ Queue depth (queued and waiting to be retried), delivery counts and
+        the delivery latency, from queueing to a successful post, in seconds.
+        """
+        pipe = self.redis.pipeline()
+        pipe.llen(self.queue_key)
+        pipe.zcard(self.retry_key)
+        queued, retrying = pipe.execute()
+        with self.lock:
+            return {
+                'queued': queued,
+                'retrying': retrying,
+                'delivered': self.delivered,
+                'retried': self.retried,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'latency_average': self.latency_total / self.delivered if self.delivered > 0 else 0.0,
+                'latency_max': self.latency_max
+            }
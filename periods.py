@@ -0,0 +1,47 @@
+import time as _time
+from datetime import datetime
+
+class MonthClock(object):
+    """ The current scoring period: a calendar month, in local time. The
+    period key ("2015-09"), its display label ("September 2015") and the
+    instants the month starts and rolls over are worked out once per month;
+    in between, reading the period only compares the time with them.
+
+    time is the time source, in seconds since the epoch, so that tests can
+    drive the clock instead of waiting for a month to pass.
+    """
+    def __init__(self, time = _time.time):
+        self.time = time
+        self.period = None
+
+    def current(self):
+        """ Returns (key, label, start, rollover) for the current month. """
+        now = self.time()
+        period = self.period
+        if period == None or not period[2] <= now < period[3]:
+            period = self.period = self.month_of(now)
+        return period
+
+    @staticmethod
+    def month_of(timestamp):
+        start = datetime.fromtimestamp(timestamp).replace(day = 1, hour = 0, minute = 0, second = 0, microsecond = 0)
+        if start.month == 12:
+            rollover = start.replace(year = start.year + 1, month = 1)
+        else:
+            rollover = start.replace(month = start.month + 1)
+        key = "{0}-{1}".format(start.year, str(start.month).zfill(2))
+        label = "{0} {1}".format(start.strftime("%B"), start.year)
+        return key, label, start.timestamp(), rollover.timestamp()
+
+    @property
+    def key(self):
+        return self.current()[0]
+
+    @property
+    def label(self):
+        return self.current()[1]
+
+    @property
+    def rollover(self):
+        """ When the next month starts, in seconds since the epoch. """
+        return self.current()[3]
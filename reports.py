@@ -0,0 +1,60 @@
+import queue
+import threading
+import time
+import requests
+import logs
+
+_log = logs.get_logger("trebek.reports")
+
+class InvalidClueReporter(object):
+    """ Reports invalid clues to jservice from a background thread, so that
+    the /trebek invalid command never waits on jservice. Reports are queued
+    in process and retried with exponential backoff; one that still fails
+    after max_attempts is dropped, as the clue is already blocked locally.
+    """
+    url = "http://jservice.io/api/invalid?id={0}"
+
+    def __init__(self, http, max_attempts = 5, backoff = 1.0):
+        self.http = http
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.reports = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.sent = 0
+        self.failed = 0
+
+    def report(self, clue_id):
+        self.start()
+        self.reports.put(clue_id)
+
+    def start(self):
+        with self.lock:
+            if self.thread != None:
+                return
+            self.thread = threading.Thread(target = self.run, daemon = True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.send(self.reports.get())
+
+    def send(self, clue_id):
+        """ Posts one report, retrying until it is accepted or max_attempts
+        posts have failed. Returns whether it was accepted.
+        """
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                resp = self.http.post(self.url.format(clue_id), timeout = 5)
+                if resp.status_code == 200:
+                    self.sent += 1
+                    return True
+                _log.warning("failed to report clue %s as invalid: %s", clue_id, resp.status_code)
+            except requests.RequestException as e:
+                _log.warning("failed to report clue %s as invalid: %s", clue_id, e)
+
+        self.failed += 1
+        _log.error("giving up on reporting clue %s as invalid", clue_id)
+        return False
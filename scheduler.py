@@ -0,0 +1,67 @@
+import heapq
+import json
+import threading
+import time
+import logs
+
+_log = logs.get_logger("trebek.scheduler")
+
+class ExpirationScheduler(object):
+    """ Runs the answer expirations for every room from a single worker thread
+    and a heap of (deadline, room_id, clue_id) entries, instead of one Timer
+    thread per clue.
+
+    When given a redis client, pending deadlines are also kept in a sorted set
+    so that they are picked back up after a restart. An entry is claimed with
+    ZREM before its callback runs, so when several processes restore the same
+    entries only one of them fires it.
+    """
+    pending_key = "pendingExpirations"
+
+    def __init__(self, callback, redis_client = None):
+        self.callback = callback
+        self.redis = redis_client
+        self.heap = []
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, deadline, room_id, clue_id):
+        self.start()
+        if self.redis != None:
+            self.redis.zadd(self.pending_key, {json.dumps([room_id, clue_id]): deadline})
+        with self.condition:
+            heapq.heappush(self.heap, (deadline, room_id, clue_id))
+            self.condition.notify()
+
+    def start(self):
+        with self.condition:
+            if self.thread != None:
+                return
+            self.restore()
+            self.thread = threading.Thread(target = self.run, daemon = True)
+            self.thread.start()
+
+    def restore(self):
+        if self.redis == None:
+            return
+        for member, deadline in self.redis.zrange(self.pending_key, 0, -1, withscores = True):
+            room_id, clue_id = json.loads(member.decode())
+            heapq.heappush(self.heap, (deadline, room_id, clue_id))
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.heap) == 0 or self.heap[0][0] > time.time():
+                    timeout = None if len(self.heap) == 0 else self.heap[0][0] - time.time()
+                    self.condition.wait(timeout)
+                deadline, room_id, clue_id = heapq.heappop(self.heap)
+            self.expire(room_id, clue_id)
+
+    def expire(self, room_id, clue_id):
+        # a failed claim or callback costs only this clue, never the worker
+        try:
+            if self.redis != None and not self.redis.zrem(self.pending_key, json.dumps([room_id, clue_id])):
+                return
+            self.callback(room_id, clue_id)
+        except Exception as e:
+            _log.exception("failed to expire clue %s in room %s: %s", clue_id, room_id, e)
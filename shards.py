@@ -0,0 +1,32 @@
+import bisect
+import hashlib
+
+class ShardRouter(object):
+    """ Consistently hashes rooms onto a set of redis nodes. Every node is
+    placed on a hash ring at `replicas` points named after the node, and a
+    room belongs to the first point at or after its own hash, so adding or
+    removing a node only moves the rooms next to that node's points.
+
+    nodes is a list of (name, client) pairs; the name (usually the node's
+    URL) decides where the node sits on the ring, so it has to stay the same
+    between deploys for rooms to keep their node.
+    """
+    def __init__(self, nodes, replicas = 100):
+        if len(nodes) == 0:
+            raise ValueError("a shard router needs at least one redis node")
+        self.nodes = dict(nodes)
+        self.ring = sorted((self.hash("{0}#{1}".format(name, i)), name)
+                for name, client in nodes for i in range(replicas))
+        self.points = [point for point, name in self.ring]
+
+    @staticmethod
+    def hash(value):
+        return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+    def node_for(self, room_id):
+        """ Returns the name of the node that holds room_id's keys. """
+        i = bisect.bisect(self.points, self.hash(room_id)) % len(self.ring)
+        return self.ring[i][1]
+
+    def client_for(self, room_id):
+        return self.nodes[self.node_for(room_id)]
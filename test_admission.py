@@ -0,0 +1,62 @@
+import json
+import unittest
+import fakeredis
+import admission
+import entities
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.redis = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer())
+        self.gate = admission.Admission(self.redis, time = lambda: self.now)
+        self.gate.room_rate, self.gate.room_burst = 1, 3
+        self.gate.user_rate, self.gate.user_burst = 0.5, 2
+
+    def message(self, message_id, user_id = 582174, room_id = 436620):
+        with open('test-room-message.json') as data:
+            d = json.load(data)
+        d['item']['message']['id'] = message_id
+        d['item']['message']['from']['id'] = user_id
+        d['item']['room']['id'] = room_id
+        return entities.HipChatRoomMessage(**d)
+
+    def test_retried_webhook_gets_the_first_response(self):
+        msg = self.message("a")
+        self.assertEqual(("admitted", None), self.gate.admit(msg))
+        self.assertEqual(("duplicate", ""), self.gate.admit(msg)) # still being handled
+        self.gate.remember(msg, "the response")
+        self.assertEqual(("duplicate", "the response"), self.gate.admit(msg))
+
+    def test_forgotten_message_is_admitted_again(self):
+        msg = self.message("a")
+        self.gate.admit(msg)
+        self.gate.forget(msg)
+        self.assertEqual(("admitted", None), self.gate.admit(msg))
+
+    def test_user_is_limited_to_their_burst_then_refilled(self):
+        self.assertEqual("admitted", self.gate.admit(self.message("a"))[0])
+        self.assertEqual("admitted", self.gate.admit(self.message("b"))[0])
+        self.assertEqual("limited", self.gate.admit(self.message("c"))[0])
+        self.assertEqual("admitted", self.gate.admit(self.message("d", user_id = 2))[0])
+
+        self.now += 2 # one token back at half a token a second
+        self.assertEqual("admitted", self.gate.admit(self.message("c"))[0])
+        self.assertEqual("limited", self.gate.admit(self.message("e"))[0])
+
+    def test_room_is_limited_across_users(self):
+        for user_id in range(3):
+            self.assertEqual("admitted", self.gate.admit(self.message(str(user_id), user_id = user_id))[0])
+        self.assertEqual("limited", self.gate.admit(self.message("x", user_id = 10))[0])
+        self.assertEqual("admitted", self.gate.admit(self.message("y", user_id = 10, room_id = 2))[0])
+
+    def test_limited_message_takes_no_token(self):
+        self.gate.user_burst = 1
+        self.assertEqual("admitted", self.gate.admit(self.message("a"))[0])
+        self.assertEqual("limited", self.gate.admit(self.message("b"))[0])
+        # the room still has two of its three tokens
+        self.assertEqual("admitted", self.gate.admit(self.message("c", user_id = 2))[0])
+        self.assertEqual("admitted", self.gate.admit(self.message("d", user_id = 3))[0])
+        self.assertEqual("limited", self.gate.admit(self.message("e", user_id = 4))[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import unittest
+import fakeredis
+import clue_index
+import entities
+
+def create_clue(id, title, value, airdate):
+    with open('test-json-output.json') as json_data:
+        clue = json.load(json_data)
+    clue['id'] = id
+    clue['value'] = value
+    clue['airdate'] = airdate
+    clue['category']['title'] = title
+    return entities.Question(**clue)
+
+class TestClueIndex(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer())
+        self.index = clue_index.ClueIndex(self.redis)
+        self.index.add([
+            create_clue(1, "THE BIBLE", 200, "1995-01-02"),
+            create_clue(2, "Potent Potables", 400, "1995-03-04"),
+            create_clue(3, "potent potables!", 200, "2005-05-06")])
+
+    def test_category_titles_are_normalized(self):
+        self.assertEqual("bible", clue_index.normalize_category("The  Bible"))
+        self.assertEqual("potent potables", clue_index.normalize_category("POTENT POTABLES!"))
+        self.assertEqual(1, self.index.random_clue(category = "bible").id)
+
+    def test_clue_is_picked_from_every_criterion_given(self):
+        self.assertIn(self.index.random_clue(category = "potent potables").id, (2, 3))
+        self.assertEqual(3, self.index.random_clue(category = "potent potables", value = 200).id)
+        self.assertEqual(2, self.index.random_clue(category = "potent potables", decade = 1990).id)
+        self.assertEqual("Let's Make a Deal", self.index.random_clue(value = 400).answer)
+
+    def test_no_matching_clue_returns_none(self):
+        self.assertEqual(None, self.index.random_clue(category = "opera"))
+        self.assertEqual(None, self.index.random_clue(category = "bible", value = 400))
+
+if __name__ == '__main__':
+    unittest.main()
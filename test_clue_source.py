@@ -0,0 +1,70 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import clue_source
+
+def get_clue_json():
+    with open('test-json-output.json') as json_data:
+        clue = json.load(json_data)
+    return clue
+
+class TestCorpusClueSource(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'clues.corpus')
+
+        other = get_clue_json()
+        other['id'] = 2
+        other['value'] = 400
+        other['category']['id'] = 7
+        other['category']['title'] = "potent potables"
+        invalid = get_clue_json()
+        invalid['id'] = 3
+        invalid['question'] = "the audio heard here, contains some test data"
+        self.written = clue_source.build_corpus([get_clue_json(), other, invalid], self.path)
+        self.source = clue_source.CorpusClueSource(self.path)
+
+    def tearDown(self):
+        self.source.corpus.close()
+        shutil.rmtree(self.directory)
+
+    def test_invalid_clues_are_dropped_when_corpus_is_built(self):
+        self.assertEqual(2, self.written)
+        self.assertEqual(2, self.source.count)
+        ids = set(c.id for c in self.source.random_clues(50))
+        self.assertEqual(set([50311, 2]), ids)
+
+    def test_random_clue_is_rehydrated_from_corpus(self):
+        clue = [c for c in self.source.random_clues(50) if c.id == 50311][0]
+        self.assertEqual("Let's Make a Deal", clue.answer)
+        self.assertEqual("classic game show taglines", clue.category.title)
+
+    def test_corpus_source_without_a_path_is_a_clear_error(self):
+        saved = clue_source._default_source, os.environ.get('CLUE_SOURCE'), os.environ.pop('CLUE_CORPUS_PATH', None)
+        clue_source._default_source = None
+        os.environ['CLUE_SOURCE'] = "corpus"
+        try:
+            with self.assertRaisesRegex(ValueError, "CLUE_CORPUS_PATH"):
+                clue_source.get_clue_source()
+        finally:
+            clue_source._default_source = saved[0]
+            for name, value in (('CLUE_SOURCE', saved[1]), ('CLUE_CORPUS_PATH', saved[2])):
+                if value == None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def test_csv_dump_is_loaded(self):
+        path = os.path.join(self.directory, 'clues.csv')
+        with open(path, 'w') as f:
+            f.write("id,answer,question,value,airdate,category_id,category_title\n")
+            f.write("5,<i>Hamlet</i>,\"To be, or not to be\",800,1999-01-01,9,shakespeare\n")
+        clue = clue_source.load_dump(path)[0]
+        self.assertEqual(5, clue['id'])
+        self.assertEqual(800, clue['value'])
+        self.assertEqual("shakespeare", clue['category']['title'])
+
+if __name__ == '__main__':
+    unittest.main()
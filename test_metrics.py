@@ -0,0 +1,55 @@
+import logging
+import unittest
+import fakeredis
+import metrics
+import logs
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = metrics.Registry()
+        latency = registry.histogram("test_seconds", "Test latency.", buckets = (0.1, 1.0))
+        latency.observe(0.05, command = "score")
+        latency.observe(0.5, command = "score")
+        latency.observe(5, command = "score")
+
+        lines = registry.render().splitlines()
+        self.assertEqual("# TYPE test_seconds histogram", lines[1])
+        self.assertIn('test_seconds_bucket{command="score",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{command="score",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{command="score",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{command="score"} 5.55', lines)
+        self.assertIn('test_seconds_count{command="score"} 3', lines)
+
+    def test_counters_are_kept_per_label_set(self):
+        registry = metrics.Registry()
+        commands = registry.counter("test_total", "Test commands.")
+        commands.inc(command = "GET")
+        commands.inc(command = "GET")
+        commands.inc(command = "SET")
+
+        lines = registry.render().splitlines()
+        self.assertIn('test_total{command="GET"} 2', lines)
+        self.assertIn('test_total{command="SET"} 1', lines)
+
+    def test_instrumented_redis_counts_commands_and_pipelines(self):
+        r = metrics.instrument_redis(fakeredis.FakeStrictRedis(server = fakeredis.FakeServer()))
+        before = dict(metrics.redis_commands.values)
+        r.set("key", 1)
+        pipe = r.pipeline()
+        pipe.get("key")
+        pipe.get("key")
+        pipe.execute()
+
+        get = (("command", "GET"),)
+        self.assertEqual(2, metrics.redis_commands.values[get] - before.get(get, 0))
+
+class TestRateLimitFilter(unittest.TestCase):
+    def test_repeated_messages_are_dropped_past_the_burst(self):
+        rate_limit = logs.RateLimitFilter(interval = 60, burst = 2)
+        record = lambda msg: logging.LogRecord("test", logging.WARNING, __file__, 1, msg, ("x",), None)
+
+        self.assertEqual([True, True, False], [rate_limit.filter(record("failed: %s")) for i in range(3)])
+        self.assertTrue(rate_limit.filter(record("other failure: %s")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+import fakeredis
+import requests
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+import outbox
+
+class StubHipChat(BaseHTTPRequestHandler):
+    """ Records every post and answers with the next queued (status, headers),
+    or a plain 200 once they run out.
+    """
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.posts.append(dict((k, v[0]) for k, v in parse_qs(body).items()))
+        status, headers = self.server.responses.pop(0) if len(self.server.responses) > 0 else (200, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubHipChat)
+        self.server.posts = []
+        self.server.responses = []
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.redis = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer())
+        self.http = requests.Session()
+        url = "http://127.0.0.1:{0}/v1/rooms/message".format(self.server.server_port)
+        self.outbox = outbox.Outbox(self.redis, self.http, url, workers = 0, backoff = 0.05, max_attempts = 3)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.http.close()
+
+    def test_messages_are_delivered_one_post_per_room(self):
+        self.outbox.send(1, "first")
+        self.outbox.send(2, "other room")
+        self.outbox.send(1, "second")
+
+        self.assertEqual(3, self.outbox.work_once())
+        posts = sorted(self.server.posts, key = lambda post: post['room_id'])
+        self.assertEqual(2, len(posts))
+        self.assertEqual({'room_id': '1', 'message': 'first<br/>second', 'color': 'gray', 'from': 'Trebek'}, posts[0])
+        self.assertEqual("other room", posts[1]['message'])
+
+        stats = self.outbox.stats()
+        self.assertEqual(0, stats['queued'])
+        self.assertEqual(3, stats['delivered'])
+        self.assertTrue(stats['latency_max'] > 0)
+
+    def test_failed_delivery_is_retried_with_backoff_then_given_up(self):
+        self.server.responses = [(500, {}), (500, {}), (500, {})]
+        self.outbox.send(1, "hello")
+
+        self.outbox.work_once()
+        self.assertEqual(1, self.outbox.stats()['retrying'])
+        self.assertEqual(0, self.outbox.work_once()) # not due yet
+        time.sleep(0.08)
+        self.outbox.work_once()
+        time.sleep(0.15)
+        self.outbox.work_once()
+
+        stats = self.outbox.stats()
+        self.assertEqual(3, len(self.server.posts))
+        self.assertEqual(1, stats['failed'])
+        self.assertEqual(0, stats['retrying'])
+        self.assertEqual(0, stats['delivered'])
+
+    def test_rate_limited_room_waits_for_reset(self):
+        reset = time.time() + 0.1
+        self.server.responses = [(200, {'X-Ratelimit-Remaining': '0', 'X-Ratelimit-Reset': str(reset)})]
+        self.outbox.send(1, "first")
+        self.outbox.work_once()
+        self.outbox.send(1, "second")
+        self.outbox.send(2, "other room")
+        self.outbox.work_once()
+
+        self.assertEqual(["first", "other room"], [post['message'] for post in self.server.posts])
+        time.sleep(reset - time.time() + 0.01)
+        self.outbox.work_once()
+        self.assertEqual("second", self.server.posts[-1]['message'])
+        self.assertEqual(3, self.outbox.stats()['delivered'])
+
+    def test_full_outbox_rejects_messages(self):
+        self.outbox.max_depth = 2
+        self.assertTrue(self.outbox.send(1, "one"))
+        self.assertTrue(self.outbox.send(1, "two"))
+        self.assertFalse(self.outbox.send(1, "three"))
+        self.assertEqual(1, self.outbox.stats()['rejected'])
+        self.assertEqual(2, self.outbox.stats()['queued'])
+
+    def test_worker_threads_drain_the_queue(self):
+        self.outbox.workers = 2
+        self.outbox.start()
+        self.outbox.send(1, "hello")
+        deadline = time.time() + 2
+        while len(self.server.posts) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual("hello", self.server.posts[0]['message'])
+
+if __name__ == '__main__':
+    unittest.main()
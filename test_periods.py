@@ -0,0 +1,38 @@
+import unittest
+from datetime import datetime
+import periods
+
+class FakeTime(object):
+    def __init__(self, when):
+        self.now = when.timestamp()
+
+    def __call__(self):
+        return self.now
+
+class TestMonthClock(unittest.TestCase):
+    def test_period_key_and_label(self):
+        clock = periods.MonthClock(FakeTime(datetime(2015, 9, 3, 16, 57)))
+        self.assertEqual("2015-09", clock.key)
+        self.assertEqual("September 2015", clock.label)
+        self.assertEqual(datetime(2015, 10, 1).timestamp(), clock.rollover)
+
+    def test_period_is_computed_once_per_month(self):
+        time = FakeTime(datetime(2015, 12, 31, 23, 59))
+        clock = periods.MonthClock(time)
+        first = clock.current()
+        time.now += 30
+        self.assertIs(first, clock.current())
+
+        time.now = datetime(2016, 1, 1).timestamp()
+        self.assertEqual("2016-01", clock.key)
+        self.assertEqual(datetime(2016, 2, 1).timestamp(), clock.rollover)
+
+    def test_clock_follows_time_going_backwards(self):
+        time = FakeTime(datetime(2016, 1, 15))
+        clock = periods.MonthClock(time)
+        self.assertEqual("2016-01", clock.key)
+        time.now = datetime(2015, 11, 15).timestamp()
+        self.assertEqual("2015-11", clock.key)
+
+if __name__ == '__main__':
+    unittest.main()
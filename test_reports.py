@@ -0,0 +1,52 @@
+import time
+import unittest
+import requests
+import reports
+
+class StubResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class StubHttp(object):
+    """ Answers posts with the queued responses (a status code, or an
+    exception to raise), then with 200s.
+    """
+    def __init__(self, responses = ()):
+        self.responses = list(responses)
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(url)
+        response = self.responses.pop(0) if len(self.responses) > 0 else 200
+        if isinstance(response, Exception):
+            raise response
+        return StubResponse(response)
+
+class TestInvalidClueReporter(unittest.TestCase):
+    def test_report_is_retried_until_accepted(self):
+        http = StubHttp([500, requests.ConnectionError("down")])
+        reporter = reports.InvalidClueReporter(http, backoff = 0.01)
+
+        self.assertTrue(reporter.send(50311))
+        self.assertEqual(["http://jservice.io/api/invalid?id=50311"] * 3, http.posts)
+        self.assertEqual(1, reporter.sent)
+
+    def test_report_is_given_up_after_max_attempts(self):
+        reporter = reports.InvalidClueReporter(StubHttp([500] * 3), max_attempts = 3, backoff = 0.01)
+
+        self.assertFalse(reporter.send(50311))
+        self.assertEqual(1, reporter.failed)
+
+    def test_reports_are_sent_in_the_background(self):
+        http = StubHttp()
+        reporter = reports.InvalidClueReporter(http)
+        reporter.report(1)
+        reporter.report(2)
+        deadline = time.time() + 2
+        while reporter.sent < 2 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(["http://jservice.io/api/invalid?id=1", "http://jservice.io/api/invalid?id=2"], http.posts)
+
+if __name__ == '__main__':
+    unittest.main()
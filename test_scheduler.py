@@ -0,0 +1,73 @@
+import time
+import unittest
+import fakeredis
+import scheduler
+
+class TestExpirationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.expired = []
+
+    def tearDown(self):
+        self.redis.flushall()
+
+    def record(self, room_id, clue_id):
+        self.expired.append((room_id, clue_id))
+
+    def wait_for(self, count):
+        deadline = time.time() + 2
+        while len(self.expired) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_expirations_in_every_room_run_in_deadline_order(self):
+        s = scheduler.ExpirationScheduler(self.record, self.redis)
+        now = time.time()
+        s.schedule(now + 0.2, 2, 20)
+        s.schedule(now + 0.1, 1, 10)
+        s.schedule(now + 0.3, 1, 11)
+        self.wait_for(3)
+
+        self.assertEqual([(1, 10), (2, 20), (1, 11)], self.expired)
+        self.assertEqual(0, self.redis.zcard(scheduler.ExpirationScheduler.pending_key))
+
+    def test_pending_expirations_survive_a_restart(self):
+        self.redis.zadd(scheduler.ExpirationScheduler.pending_key,
+                {'[436620, 50311]': time.time() - 1})
+        s = scheduler.ExpirationScheduler(self.record, self.redis)
+        s.start()
+        self.wait_for(1)
+
+        self.assertEqual([(436620, 50311)], self.expired)
+
+    def test_expiration_claimed_elsewhere_is_not_fired_twice(self):
+        s = scheduler.ExpirationScheduler(self.record, self.redis)
+        s.schedule(time.time() + 0.1, 1, 10)
+        self.redis.delete(scheduler.ExpirationScheduler.pending_key)
+        s.schedule(time.time() + 0.15, 1, 11)
+        self.wait_for(1)
+        time.sleep(0.1)
+
+        self.assertEqual([(1, 11)], self.expired)
+
+    def test_failed_claim_or_callback_does_not_stop_later_expirations(self):
+        zrem = self.redis.zrem
+        def zrem_failing_once(*args):
+            self.redis.zrem = zrem
+            raise ConnectionError("connection reset")
+        self.redis.zrem = zrem_failing_once
+        def record_unless_failing(room_id, clue_id):
+            if clue_id == 11:
+                raise RuntimeError("room is gone")
+            self.record(room_id, clue_id)
+
+        s = scheduler.ExpirationScheduler(record_unless_failing, self.redis)
+        now = time.time()
+        s.schedule(now + 0.05, 1, 10)
+        s.schedule(now + 0.1, 1, 11)
+        s.schedule(now + 0.15, 1, 12)
+        self.wait_for(1)
+
+        self.assertEqual([(1, 12)], self.expired)
+
+if __name__ == '__main__':
+    unittest.main()
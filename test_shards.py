@@ -0,0 +1,35 @@
+import unittest
+import shards
+
+class TestShardRouter(unittest.TestCase):
+    def create_router(self, names):
+        return shards.ShardRouter([(name, name) for name in names])
+
+    def test_a_room_always_maps_to_the_same_node(self):
+        router = self.create_router(["a", "b", "c"])
+        again = self.create_router(["c", "b", "a"])
+        for room_id in range(100):
+            self.assertEqual(router.node_for(room_id), again.node_for(room_id))
+            self.assertEqual(router.node_for(room_id), router.client_for(room_id))
+
+    def test_rooms_are_spread_over_every_node(self):
+        router = self.create_router(["a", "b", "c"])
+        counts = {}
+        for room_id in range(3000):
+            node = router.node_for(room_id)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(["a", "b", "c"], sorted(counts.keys()))
+        self.assertTrue(min(counts.values()) > 600)
+
+    def test_adding_a_node_only_moves_rooms_onto_it(self):
+        router = self.create_router(["a", "b", "c"])
+        grown = self.create_router(["a", "b", "c", "d"])
+        moved = [room_id for room_id in range(1000) if router.node_for(room_id) != grown.node_for(room_id)]
+        self.assertTrue(len(moved) < 400)
+        self.assertTrue(all(grown.node_for(room_id) == "d" for room_id in moved))
+
+    def test_router_needs_a_node(self):
+        self.assertRaises(ValueError, shards.ShardRouter, [])
+
+if __name__ == '__main__':
+    unittest.main()
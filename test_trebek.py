@@ -2,10 +2,15 @@ import os
 import unittest
 import json
 import trebek
+import matching
+import commands
 import entities
 import fakeredis
 import time
 import datetime
+import benchmark
+import bottle
+import periods
 
 # Reference this SO post on getting distances between strings:
 # http://stackoverflow.com/a/1471603/98562
@@ -17,17 +22,13 @@ def get_clue_json():
 def fake_fetch_random_clue():
     return entities.Question(**get_clue_json())
 
-def fake_get_year_month():
-    now = datetime.datetime.now()
-    year, month = divmod(now.month + 1, 12)
-    if month == 0: 
-        month = 12
-        year = year -1
-    next_month = datetime.datetime(now.year + year, month, 1)
-    return "{0}-{1}".format(next_month.year, str(next_month.month).zfill(2))
+def next_month_clock():
+    rollover = periods.MonthClock().rollover
+    return periods.MonthClock(lambda: rollover + 60)
 
 _fetch_count = 0
 _invalid_clue = None
+_redis = fakeredis.FakeStrictRedis()
 
 def fetch_invalid_clue():
     global _fetch_count, _invalid_clue
@@ -44,16 +45,16 @@ class TestTrebek(unittest.TestCase):
         self.trebek_bot = self.create_bot_with_dictionary(d)
 
     def tearDown(self):
-        self.trebek_bot.redis.flushall() 
+        self.trebek_bot.redis.flushall()
+        trebek._user_names.clear()
 
     def get_setup_json(self):
         with open('test-room-message.json') as data:
             d = json.load(data)
         return d
 
-    def create_bot_with_dictionary(self, room_dictionary):
-        bot = trebek.Trebek(entities.HipChatRoomMessage(**room_dictionary))
-        bot.redis = fakeredis.FakeStrictRedis()
+    def create_bot_with_dictionary(self, room_dictionary, redis_client = _redis):
+        bot = trebek.Trebek(entities.HipChatRoomMessage(**room_dictionary), redis_client = redis_client)
         bot.fetch_random_clue = fake_fetch_random_clue
         return bot
     
@@ -78,7 +79,7 @@ class TestTrebek(unittest.TestCase):
         r.set(hipchat.format(12), 'Michael')
         r.set(hipchat.format(13), 'Reggie')
         r.set(hipchat.format(14), 'Legacy Score')
-        user = bot.user_score_prefix + ":{0}"
+        user = "{0}-user_score:{{0}}".format(bot.get_year_month())
         r.set(user.format(1), 100)
         r.set(user.format(2), 20)
         r.set(user.format(3), 70)
@@ -94,8 +95,8 @@ class TestTrebek(unittest.TestCase):
         r.set(user.format(13), 87)
         # Regression test old score keys will still appear in lifetime loserboard
         r.set("user_score:{0}".format(14), 5)
-        bot.get_year_month = fake_get_year_month
-        user = bot.user_score_prefix + ":{0}"
+        bot.clock = next_month_clock()
+        user = "{0}-user_score:{{0}}".format(bot.get_year_month())
         r.set(user.format(1), 100)
         r.set(user.format(2), 20)
         r.set(user.format(3), 70)
@@ -109,6 +110,72 @@ class TestTrebek(unittest.TestCase):
         r.set(user.format(11), 225) 
         r.set(user.format(12), 94)
         r.set(user.format(13), 87)
+        trebek.migrate_user_scores(r)
+        trebek.migrate_user_names(r)
+
+    def test_bots_share_process_wide_redis_and_http_clients(self):
+        saved = trebek.clue_source._default_source
+        trebek.clue_source._default_source = None
+        try:
+            first = trebek.Trebek(self.room_message)
+            second = trebek.Trebek(self.room_message)
+        finally:
+            trebek.clue_source._default_source = saved
+        self.assertIs(first.redis, second.redis)
+        self.assertIs(first.redis.connection_pool, trebek.get_redis().connection_pool)
+        self.assertIs(first.clue_source, second.clue_source)
+        self.assertIs(trebek.get_http(), first.clue_source.http)
+
+    def test_metrics_endpoint_reports_command_latency(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek score"
+        self.create_bot_with_dictionary(d).get_response_message()
+
+        text = trebek.metrics_endpoint()
+        self.assertIn("# TYPE trebek_command_seconds histogram", text)
+        self.assertIn('trebek_command_seconds_count{command="get_user_score"}', text)
+
+    def test_retried_webhook_is_answered_without_running_the_command_again(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek score"
+        saved = trebek._redis, trebek._room_router
+        trebek._redis, trebek._room_router = _redis, None
+        try:
+            app = bottle.default_app()
+            first = benchmark.post(app, d)
+            self.trebek_bot.update_score(500)
+            retry = benchmark.post(app, d)
+            d['item']['message']['id'] = "another message"
+            second = benchmark.post(app, d)
+        finally:
+            trebek._redis, trebek._room_router = saved
+
+        self.assertEqual("$0", json.loads(first.decode())['message'])
+        self.assertEqual(first, retry)
+        self.assertEqual("$500", json.loads(second.decode())['message'])
+
+    def test_retry_after_failed_delivery_runs_the_command_again(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek score"
+        d['item']['message']['id'] = "failed delivery"
+        get_response_message = trebek.Trebek.get_response_message
+        def fail(bot):
+            raise RuntimeError("transient failure")
+
+        saved = trebek._redis, trebek._room_router
+        trebek._redis, trebek._room_router = _redis, None
+        try:
+            app = bottle.default_app()
+            trebek.Trebek.get_response_message = fail
+            with self.assertRaises(RuntimeError):
+                benchmark.post(app, d)
+            trebek.Trebek.get_response_message = get_response_message
+            retry = benchmark.post(app, d)
+        finally:
+            trebek.Trebek.get_response_message = get_response_message
+            trebek._redis, trebek._room_router = saved
+
+        self.assertEqual("$0", json.loads(retry.decode())['message'])
 
     def test_when_value_not_included_default_to_200(self):
         test_clue = self.trebek_bot.fetch_random_clue()
@@ -150,6 +217,15 @@ class TestTrebek(unittest.TestCase):
         self.assertTrue(self.trebek_bot.is_correct_answer("a turtle (or a tortoise)", "tortoise"))
         # self.assertTrue(self.trebek_bot.is_correct_answer("ben affleck and matt damon", "Matt Damon & Ben Affleck"))
 
+    def test_answer_matcher_precomputes_alternate_forms(self):
+        matcher = matching.AnswerMatcher("a turtle (or a tortoise)")
+        self.assertEqual(("turtle or a tortoise", "a tortoise", "turtle"), matcher.forms)
+        self.assertTrue(matcher.matches("what is a turtle?", lambda expected, actual: False))
+
+    def test_answer_matcher_is_built_once_per_answer(self):
+        matcher = matching.get_matcher("(William) Blake")
+        self.assertIs(matcher, matching.get_matcher("(William) Blake"))
+
     def test_given_json_dictionary_hipchat_object_is_parsed(self):
         with open ('test-room-message.json') as data:
             d = json.load(data)
@@ -166,12 +242,50 @@ class TestTrebek(unittest.TestCase):
 
     def test_when_get_response_message_is_called_user_name_is_saved(self):
         self.trebek_bot.get_response_message()
-        key = trebek.Trebek.hipchat_user_key.format('582174')
-        self.assertTrue(self.trebek_bot.redis.exists(key))
+        key = trebek.Trebek.hipchat_users_key
+        self.assertTrue(self.trebek_bot.redis.hexists(key, '582174'))
 
-        user_name = self.trebek_bot.redis.get(trebek.Trebek.hipchat_user_key.format('582174')).decode()
+        user_name = self.trebek_bot.redis.hget(key, '582174').decode()
         self.assertEqual("James A", user_name)
 
+    def test_router_dispatches_commands_and_falls_back_to_answers(self):
+        router = trebek.Trebek.router
+        self.assertEqual(("get_user_score", {'lifetime': True}), router.route("lifetime score"))
+        self.assertEqual(("get_leaderboard", {}), router.route("show me the leaderboard"))
+        self.assertEqual(("get_question", {}), router.route("jeopardy me"))
+        self.assertEqual(("get_question", {'category': "potent potables"}), router.route("jeopardy potent potables"))
+        self.assertEqual(("process_answer", {}), router.route("what is Let's Make a Deal"))
+
+    def test_new_commands_can_be_registered_on_a_router(self):
+        router = commands.CommandRouter()
+        router.register(r'^score$', trebek.Trebek.get_user_score)
+        router.route("score")
+        router.register(r'^ping$', trebek.Trebek.get_help, verbose = True)
+        self.assertEqual(("get_help", {'verbose': True}), router.route("ping"))
+        self.assertEqual((None, {}), router.route("pong"))
+        router.register(r'^echo (?P<text>.+)$', trebek.Trebek.get_help)
+        router.register(r'^say (?P<text>.+)$', trebek.Trebek.get_help)
+        self.assertEqual(("get_help", {'text': "hi"}), router.route("say hi"))
+
+    def test_known_user_is_not_registered_again(self):
+        self.trebek_bot.save_hipchat_user()
+        self.trebek_bot.redis.hdel(trebek.Trebek.hipchat_users_key, '582174')
+        self.trebek_bot.save_hipchat_user()
+        self.assertFalse(self.trebek_bot.redis.hexists(trebek.Trebek.hipchat_users_key, '582174'))
+
+    def test_user_registered_elsewhere_is_cached_after_one_hsetnx(self):
+        self.trebek_bot.redis.hset(trebek.Trebek.hipchat_users_key, '582174', 'Arian')
+        self.trebek_bot.save_hipchat_user()
+        self.trebek_bot.redis.hdel(trebek.Trebek.hipchat_users_key, '582174')
+        self.trebek_bot.save_hipchat_user()
+        self.assertFalse(self.trebek_bot.redis.hexists(trebek.Trebek.hipchat_users_key, '582174'))
+
+    def test_board_names_are_fetched_together_and_cached(self):
+        self.create_user_scores()
+        self.assertEqual(["Arian", "Darren S", "99"], self.trebek_bot.get_user_names(['8', '7', '99']))
+        self.trebek_bot.redis.hset(trebek.Trebek.hipchat_users_key, '8', 'Renamed')
+        self.assertEqual("Arian", self.trebek_bot.get_user_name('8'))
+
     def test_number_is_formatted_as_currency(self):
         currency = self.trebek_bot.format_currency("100")
         self.assertEqual("$100", currency)
@@ -192,9 +306,7 @@ class TestTrebek(unittest.TestCase):
         d = self.get_setup_json()
         d['item']['message']['message'] = "/trebek score"
         bot = self.create_bot_with_dictionary(d)
-        key = "{0}:{1}".format(bot.user_score_prefix,
-                bot.room_message.item.message.user_from.id)
-        bot.redis.set(key, 500)
+        bot.redis.zadd(bot.score_board, {bot.room_message.item.message.user_from.id: 500})
         response = bot.get_response_message()
         self.assertEqual("$500", response)
 
@@ -249,8 +361,7 @@ class TestTrebek(unittest.TestCase):
         self.trebek_bot.get_question()
         d['item']['message']['message'] = '/trebek this is an answer'
 
-        bot = self.create_bot_with_dictionary(d)
-        bot.redis = self.trebek_bot.redis
+        bot = self.create_bot_with_dictionary(d, self.trebek_bot.redis)
 
         # Act
         response = bot.get_response_message()
@@ -262,15 +373,13 @@ class TestTrebek(unittest.TestCase):
         # Arrange 
         d = self.get_setup_json()
         d['item']['message']['message'] = '/trebek some test answer'
-        bot = self.create_bot_with_dictionary(d)
-        bot.redis = fakeredis.FakeStrictRedis()
+        bot = self.create_bot_with_dictionary(d, fakeredis.FakeStrictRedis())
         bot.get_question()
         response = bot.get_response_message()
-        user_score_key = "{0}:{1}".format(bot.user_score_prefix,
-                self.trebek_bot.room_message.item.message.user_from.id)
+        user_id = self.trebek_bot.room_message.item.message.user_from.id
 
         # Act
-        score = bot.redis.get(user_score_key)
+        score = bot.redis.zscore(bot.score_board, user_id)
         bot.redis.flushdb()
 
         # Assert
@@ -282,34 +391,68 @@ class TestTrebek(unittest.TestCase):
         # Arrange 
         d = self.get_setup_json()
         d['item']['message']['message'] = "/trebek what is Let's Make a deal"
-        bot = self.create_bot_with_dictionary(d)
-        bot.redis = fakeredis.FakeStrictRedis()
+        bot = self.create_bot_with_dictionary(d, fakeredis.FakeStrictRedis())
+        self.assertIs(bot.redis, bot.room_redis) # claimed and scored by one script
         bot.get_question()
         response = bot.get_response_message()
-        user_score_key = "{0}:{1}".format(bot.user_score_prefix,
-                self.trebek_bot.room_message.item.message.user_from.id)
+        user_id = self.trebek_bot.room_message.item.message.user_from.id
 
         # Act
-        score = bot.redis.get(user_score_key)
+        score = bot.redis.zscore(bot.score_board, user_id)
         bot.redis.flushdb()
 
         # Assert
         self.assertEqual("$200", bot.format_currency(score))
         self.assertEqual("That is correct, James A. Your score is now $200 (Expected Answer: Let's Make a Deal)", response)
 
+    def test_room_state_and_scores_can_live_on_different_nodes(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek what is Let's Make a deal"
+        room_redis = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer())
+        bot = trebek.Trebek(entities.HipChatRoomMessage(**d), redis_client = _redis, room_redis_client = room_redis)
+        bot.fetch_random_clue = fake_fetch_random_clue
+        bot.get_question()
+        self.assertTrue(room_redis.exists(bot.clue_key.format(bot.room_id)))
+        self.assertFalse(_redis.exists(bot.clue_key.format(bot.room_id)))
+
+        response = bot.get_response_message()
+        user_id = bot.room_message.item.message.user_from.id
+        self.assertEqual("That is correct, James A. Your score is now $200 (Expected Answer: Let's Make a Deal)", response)
+        self.assertEqual(200, _redis.zscore(bot.score_board, user_id))
+        self.assertFalse(room_redis.exists(bot.clue_key.format(bot.room_id)))
+        self.assertEqual(None, bot.get_response_message())
+
+    def test_refused_claim_on_another_node_is_not_scored(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek what is wrong"
+        scores = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer())
+        room_redis = fakeredis.FakeStrictRedis(server = fakeredis.FakeServer())
+        bot = trebek.Trebek(entities.HipChatRoomMessage(**d), redis_client = scores, room_redis_client = room_redis)
+        bot.fetch_random_clue = fake_fetch_random_clue
+        bot.get_question()
+        raw_clue = room_redis.get(bot.clue_key.format(bot.room_id))
+        clue = bot.get_active_clue()
+        user_id = bot.room_message.item.message.user_from.id
+
+        self.assertEqual([b"incorrect", -200], bot.settle_answer(raw_clue, clue, "incorrect"))
+        self.assertEqual([b"answered"], bot.settle_answer(raw_clue, clue, "incorrect"))
+        self.assertEqual(-200, scores.zscore(bot.score_board, user_id))
+
+        room_redis.delete(bot.clue_key.format(bot.room_id))
+        self.assertEqual([b"gone"], bot.settle_answer(raw_clue, clue, "correct"))
+        self.assertEqual(-200, scores.zscore(bot.score_board, user_id))
+
     def test_given_correct_answer_nonQuestion_form_user_score_decreased(self):
         # Arrange 
         d = self.get_setup_json()
         d['item']['message']['message'] = "/trebek Let's Make a deal"
-        bot = self.create_bot_with_dictionary(d)
-        bot.redis = fakeredis.FakeStrictRedis()
+        bot = self.create_bot_with_dictionary(d, fakeredis.FakeStrictRedis())
         bot.get_question()
         response = bot.get_response_message()
-        user_score_key = "{0}:{1}".format(bot.user_score_prefix,
-                self.trebek_bot.room_message.item.message.user_from.id)
+        user_id = self.trebek_bot.room_message.item.message.user_from.id
 
         # Act
-        score = bot.redis.get(user_score_key)
+        score = bot.redis.zscore(bot.score_board, user_id)
         bot.redis.flushdb()
 
         # Assert
@@ -317,23 +460,37 @@ class TestTrebek(unittest.TestCase):
         self.assertEqual(score_string, bot.format_currency(score))
         self.assertEqual("That is correct James A, however responses should be in the form of a question. Your score is now {0}".format(score_string), response)
     
+    def test_two_simultaneous_correct_answers_only_score_once(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek what is Let's Make a deal"
+        first = self.create_bot_with_dictionary(d)
+        first.get_question()
+        raw_clue = first.redis.get(first.clue_key.format(first.room_id))
+        clue = first.get_active_clue()
+        d['item']['message']['from']['id'] = 1
+        second = self.create_bot_with_dictionary(d)
+
+        # Both players read the clue before either answer is settled
+        self.assertEqual([b"correct", b"200"], first.settle_answer(raw_clue, clue, "correct"))
+        self.assertEqual([b"gone"], second.settle_answer(raw_clue, clue, "correct"))
+        self.assertEqual(None, second.redis.zscore(second.score_board, 1))
+        self.assertEqual(None, second.get_response_message())
+
     def test_given_incorrect_answer_time_is_up_response(self):
         # Arrange 
         d = self.get_setup_json()
         d['item']['message']['message'] = "/trebek foobar"
-        bot = self.create_bot_with_dictionary(d)
-        bot.redis = fakeredis.FakeStrictRedis()
+        bot = self.create_bot_with_dictionary(d, fakeredis.FakeStrictRedis())
         bot.get_question()
         clue = bot.get_active_clue()
         clue.expiration = time.time() - (bot.seconds_to_expire + 1)
         key = bot.clue_key.format(bot.room_id)
-        bot.redis.set(key, json.dumps(clue, cls = entities.QuestionEncoder))
+        bot.room_redis.set(key, json.dumps(clue, cls = entities.QuestionEncoder))
         response = bot.get_response_message()
-        user_score_key = "{0}:{1}".format(bot.user_score_prefix,
-                self.trebek_bot.room_message.item.message.user_from.id)
+        user_id = self.trebek_bot.room_message.item.message.user_from.id
 
         # Act
-        score = bot.redis.get(user_score_key)
+        score = bot.redis.zscore(bot.score_board, user_id)
         bot.redis.flushdb()
 
         # Assert
@@ -344,19 +501,17 @@ class TestTrebek(unittest.TestCase):
         # Arrange 
         d = self.get_setup_json()
         d['item']['message']['message'] = "/trebek what is Let's Make a deal"
-        bot = self.create_bot_with_dictionary(d)
-        bot.redis = fakeredis.FakeStrictRedis()
+        bot = self.create_bot_with_dictionary(d, fakeredis.FakeStrictRedis())
         bot.get_question()
         clue = bot.get_active_clue()
         clue.expiration = time.time() - (bot.seconds_to_expire + 1)
         key = bot.clue_key.format(bot.room_id)
-        bot.redis.set(key, json.dumps(clue, cls = entities.QuestionEncoder))
+        bot.room_redis.set(key, json.dumps(clue, cls = entities.QuestionEncoder))
         response = bot.get_response_message()
-        user_score_key = "{0}:{1}".format(bot.user_score_prefix,
-                self.trebek_bot.room_message.item.message.user_from.id)
+        user_id = self.trebek_bot.room_message.item.message.user_from.id
 
         # Act
-        score = bot.redis.get(user_score_key)
+        score = bot.redis.zscore(bot.score_board, user_id)
         bot.redis.flushdb()
 
         # Assert
@@ -395,6 +550,39 @@ class TestTrebek(unittest.TestCase):
         q = entities.Question(1, answer= "Theodore Roosevelt", category = c)
         self.assertEqual("Theodore Roosevelt", q.answer)
 
+    def test_stored_clue_is_rehydrated_without_reparsing(self):
+        clue = fake_fetch_random_clue()
+        record = json.loads(json.dumps(clue, cls = entities.QuestionEncoder))
+        self.assertEqual("Let's Make a Deal", record['answer'])
+
+        rehydrated = entities.Question.from_record(record)
+        self.assertFalse(hasattr(rehydrated, '__dict__'))
+        self.assertEqual("2001-10-18T12:00:00+00:00", rehydrated._airdate)
+        self.assertEqual("Let's Make a Deal", rehydrated.answer)
+        self.assertEqual(200, rehydrated.value)
+        self.assertEqual("classic game show taglines", rehydrated.category.title)
+        self.assertEqual(clue.airdate, rehydrated.airdate)
+
+    def test_active_clue_is_stored_in_compact_format(self):
+        clue = fake_fetch_random_clue()
+        clue.expiration = 1000.5
+        encoded = entities.encode_clue(clue)
+        self.assertTrue(len(encoded) < len(json.dumps(clue, cls = entities.QuestionEncoder)) / 2)
+
+        decoded = entities.decode_clue(encoded.encode())
+        self.assertEqual(50311, decoded.id)
+        self.assertEqual("Let's Make a Deal", decoded.answer)
+        self.assertEqual(200, decoded.value)
+        self.assertEqual("classic game show taglines", decoded.category.title)
+        self.assertEqual(clue.airdate, decoded.airdate)
+        self.assertEqual(1000.5, decoded.expiration)
+
+    def test_active_clue_in_previous_json_format_is_still_read(self):
+        clue = fake_fetch_random_clue()
+        self.trebek_bot.redis.set(self.trebek_bot.clue_key.format(self.trebek_bot.room_id),
+                json.dumps(clue, cls = entities.QuestionEncoder))
+        self.assertEqual("Let's Make a Deal", self.trebek_bot.get_active_clue().answer)
+
     def test_when_fetched_clue_is_invalid_get_new_clue(self):
         global _invalid_clue, _fetch_count
         _fetch_count = 0
@@ -438,10 +626,128 @@ class TestTrebek(unittest.TestCase):
         clue = self.trebek_bot.get_jeopardy_clue()
         self.assertFalse("heard here" in clue.question)
 
+    def test_clue_pool_is_refilled_with_only_valid_clues(self):
+        invalid = get_clue_json()
+        invalid['question'] = "the picture seen here, contains some test data"
+        self.trebek_bot.fetch_random_clues = lambda count: \
+                [entities.Question(**invalid)] + [fake_fetch_random_clue() for i in range(count)]
+        self.trebek_bot.clue_pool_size = 3
+
+        self.assertEqual(3, self.trebek_bot.refill_clue_pool())
+        pool = self.trebek_bot.redis.lrange(trebek.Trebek.clue_pool_key, 0, -1)
+        self.assertEqual(3, len(pool))
+        self.assertFalse(any("seen here" in entities.decode_clue(c).question for c in pool))
+
+    def test_when_clue_pool_has_clues_no_clue_is_fetched(self):
+        self.trebek_bot.clue_pool_size = 1
+        self.trebek_bot.fetch_random_clues = lambda count: [fake_fetch_random_clue()]
+        self.trebek_bot.refill_clue_pool()
+        self.trebek_bot.fetch_random_clue = None
+
+        clue = self.trebek_bot.get_jeopardy_clue()
+        self.assertEqual(50311, clue.id)
+        self.assertTrue(clue.expiration > time.time())
+        self.assertEqual(0, self.trebek_bot.redis.llen(trebek.Trebek.clue_pool_key))
+
+    def test_themed_round_picks_a_clue_from_the_requested_category(self):
+        self.trebek_bot.fetch_random_clues = lambda count: [fake_fetch_random_clue()]
+        self.trebek_bot.clue_pool_size = 1
+        self.trebek_bot.refill_clue_pool()
+        self.trebek_bot.fetch_random_clue = None
+
+        response = self.trebek_bot.get_question("Classic Game Show Taglines")
+        self.assertTrue(response.startswith("The category is <b>CLASSIC GAME SHOW TAGLINES</b>"))
+        self.assertEqual(50311, self.trebek_bot.get_active_clue().id)
+        self.assertEqual(1, self.trebek_bot.redis.llen(trebek.Trebek.clue_pool_key))
+
+    def test_themed_round_in_unknown_category_does_not_start(self):
+        self.trebek_bot.fetch_random_clue = None
+        response = self.trebek_bot.get_question("opera")
+        self.assertEqual("I don't know any new clues in the category <b>OPERA</b> yet.", response)
+        self.assertEqual(None, self.trebek_bot.get_active_clue())
+
+    def fill_clue_pool(self, ids):
+        self.trebek_bot.redis.rpush(trebek.Trebek.clue_pool_key,
+                *[entities.encode_clue(entities.Question(**dict(get_clue_json(), id = i))) for i in ids])
+
+    def test_played_clues_are_skipped(self):
+        self.fill_clue_pool([1, 2, 1, 3])
+        self.trebek_bot.fetch_random_clue = None
+        self.assertEqual([1, 2, 3], [self.trebek_bot.get_jeopardy_clue().id for i in range(3)])
+        self.assertEqual(1, self.trebek_bot.redis.getbit(trebek.Trebek.seen_clues_key, 2))
+
+    def test_played_clues_are_left_out_of_the_clue_pool(self):
+        self.trebek_bot.mark_clue_seen(entities.Question(**dict(get_clue_json(), id = 1)))
+        self.trebek_bot.fetch_random_clues = lambda count: \
+                [entities.Question(**dict(get_clue_json(), id = i)) for i in (1, 2)]
+        self.trebek_bot.clue_pool_size = 1
+
+        self.assertEqual(1, self.trebek_bot.refill_clue_pool())
+        self.trebek_bot.fetch_random_clue = None
+        self.assertEqual(2, self.trebek_bot.get_jeopardy_clue().id)
+
+    def test_clues_can_be_tracked_per_room(self):
+        self.fill_clue_pool([1, 1])
+        self.trebek_bot.fetch_random_clue = None
+        self.trebek_bot.seen_clues = "room"
+        self.assertEqual(1, self.trebek_bot.get_jeopardy_clue().id)
+        d = self.get_setup_json()
+        d['item']['room']['id'] = 2
+        other_room = self.create_bot_with_dictionary(d)
+        other_room.seen_clues = "room"
+        self.assertEqual(1, other_room.get_jeopardy_clue().id)
+
+    def test_themed_round_does_not_repeat_a_played_clue(self):
+        self.trebek_bot.clue_index.add([fake_fetch_random_clue()])
+        self.assertEqual(50311, self.trebek_bot.get_jeopardy_clue("classic game show taglines").id)
+        self.assertEqual(None, self.trebek_bot.get_jeopardy_clue("classic game show taglines"))
+
+    def test_invalid_clue_is_blocked_and_reported_in_the_background(self):
+        reported = []
+        self.trebek_bot.reporter = type("StubReporter", (object,), {"report": lambda self, clue_id: reported.append(clue_id)})()
+        self.trebek_bot.get_question()
+        self.assertEqual("Submitted question as invalid. It will not be asked again.", self.trebek_bot.post_clue_invalid())
+
+        self.assertEqual([50311], reported)
+        self.assertTrue(self.trebek_bot.is_blocked(fake_fetch_random_clue()))
+        self.assertFalse(self.trebek_bot.is_valid_clue(fake_fetch_random_clue()))
+
+    def test_invalid_without_active_clue_does_not_crash(self):
+        self.assertEqual("No active clue. Type '/trebek jeopardy' to start a round", self.trebek_bot.post_clue_invalid())
+
+    def test_blocked_clues_are_dropped_from_the_clue_pool(self):
+        self.fill_clue_pool([1, 2])
+        self.trebek_bot.redis.sadd(trebek.Trebek.blocked_clues_key, 1, 3)
+        self.trebek_bot.fetch_random_clues = lambda count: \
+                [entities.Question(**dict(get_clue_json(), id = i)) for i in (3, 4)]
+        self.trebek_bot.clue_pool_size = 3
+
+        self.assertEqual(1, self.trebek_bot.refill_clue_pool())
+        self.trebek_bot.fetch_random_clue = None
+        self.assertEqual([2, 4], [self.trebek_bot.get_jeopardy_clue().id for i in range(2)])
+
+    def test_round_does_not_start_when_the_clue_source_is_empty(self):
+        del self.trebek_bot.fetch_random_clue # back to the clue source
+        self.trebek_bot.fetch_random_clues = lambda count: []
+        self.assertEqual(None, self.trebek_bot.fetch_random_clue())
+        self.assertEqual("I don't have any clues to ask right now. Try again later.", self.trebek_bot.get_question())
+        self.assertEqual(None, self.trebek_bot.get_active_clue())
+
+    def test_all_blocked_clue_source_gives_up(self):
+        fetched = []
+        def fetch_blocked_clue():
+            fetched.append(1)
+            return fake_fetch_random_clue()
+        self.trebek_bot.fetch_random_clue = fetch_blocked_clue
+        self.trebek_bot.redis.sadd(trebek.Trebek.blocked_clues_key, 50311)
+
+        self.assertEqual(None, self.trebek_bot.get_jeopardy_clue())
+        self.assertEqual(self.trebek_bot.fetch_attempts, len(fetched))
+
     def test_when_new_month_arrives_score_resets_to_zero(self):
         self.trebek_bot.update_score(200)
 
-        self.trebek_bot.get_year_month = fake_get_year_month
+        self.trebek_bot.clock = next_month_clock()
         self.assertEqual("$0", self.trebek_bot.get_user_score())
 
     def test_lifetimescore_includes_multiple_months(self):
@@ -449,7 +755,7 @@ class TestTrebek(unittest.TestCase):
         self.create_user_scores() 
         self.trebek_bot.update_score(200)
 
-        self.trebek_bot.get_year_month = fake_get_year_month
+        self.trebek_bot.clock = next_month_clock()
         self.trebek_bot.update_score(200)
         self.assertEqual("$400", self.trebek_bot.get_user_score(True))
 
@@ -481,6 +787,181 @@ class TestTrebek(unittest.TestCase):
         expected += "<li>Richard: $400</li></ol>"
         self.assertEqual(expected, response)
 
+    def test_rendered_board_is_served_from_cache(self):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = "/trebek leaderboard"
+        bot = self.create_bot_with_dictionary(d)
+        self.create_user_scores(bot)
+        board = bot.get_response_message()
+
+        bot.get_scores = None # a cached board is not rendered again
+        self.assertEqual(board, bot.get_response_message())
+
+    def test_score_change_only_drops_boards_it_shows_on(self):
+        bot = self.trebek_bot
+        self.create_user_scores(bot)
+        leaders = bot.get_leaderboard()
+        losers = bot.get_loserboard()
+        month = bot.get_year_month()
+        leaders_key = bot.rendered_board_key.format(month, "leaders")
+        losers_key = bot.rendered_board_key.format(month, "losers")
+
+        bot.update_score(10)
+        self.assertTrue(bot.redis.exists(leaders_key))
+        self.assertFalse(bot.redis.exists(losers_key))
+        self.assertNotEqual(losers, bot.get_loserboard())
+
+        bot.update_score(10000)
+        self.assertFalse(bot.redis.exists(leaders_key))
+        self.assertNotEqual(leaders, bot.get_leaderboard())
+
+    def test_board_rendered_during_a_score_change_is_not_cached(self):
+        bot = self.trebek_bot
+        self.create_user_scores(bot)
+        get_scores = bot.get_scores
+        def get_scores_then_score(lifetime, losers):
+            scores = get_scores(lifetime, losers)
+            bot.update_score(10000) # lands after the read, before the board is cached
+            return scores
+        bot.get_scores = get_scores_then_score
+        stale = bot.get_leaderboard()
+
+        bot.get_scores = get_scores
+        self.assertFalse(bot.redis.exists(bot.rendered_board_key.format(bot.get_year_month(), "leaders")))
+        self.assertNotEqual(stale, bot.get_leaderboard())
+
+    def create_counted_bot(self, message):
+        d = self.get_setup_json()
+        d['item']['message']['message'] = message
+        counter = benchmark.CommandCounter()
+        r = benchmark.count_commands(fakeredis.FakeStrictRedis(server = fakeredis.FakeServer()), counter)
+        bot = trebek.Trebek(entities.HipChatRoomMessage(**d), redis_client = r)
+        ids = iter(range(1, 100))
+        bot.fetch_random_clue = lambda: entities.Question(**dict(get_clue_json(), id = next(ids)))
+        bot.save_hipchat_user()
+        return bot, counter
+
+    def test_commands_read_in_a_single_round_trip(self):
+        bot, counter = self.create_counted_bot("/trebek what is Let's Make a deal")
+        bot.get_question()
+        bot.get_response_message() # loads the answer script
+        bot.room_redis.delete(bot.shush_answer_key.format(bot.room_id))
+        bot.redis.rpush(bot.clue_pool_key, entities.encode_clue(fake_fetch_random_clue()))
+
+        counter.reset()
+        bot.get_question()
+        commands, round_trips = counter.reset()
+        self.assertEqual(4, round_trips) # room state, clue pool, mark the clue seen, store it
+        self.assertEqual(1, commands["GET"]) # the active clue, read once
+
+        bot.get_response_message()
+        self.assertEqual(2, counter.reset()[1]) # room state, settle the answer
+
+        bot.get_answer()
+        self.assertEqual(1, counter.reset()[1]) # no active clue left
+
+        bot.get_user_score()
+        bot.get_leaderboard()
+        counter.reset()
+        bot.get_leaderboard()
+        self.assertEqual(1, counter.reset()[1]) # the cached board
+
+    def test_migration_folds_legacy_score_keys_into_boards(self):
+        r = self.trebek_bot.redis
+        r.set("2015-09-user_score:1", 100)
+        r.set("2015-10-user_score:1", -50)
+        r.set("user_score:1", 5)
+
+        self.assertEqual(3, trebek.migrate_user_scores(r))
+        self.assertEqual(0, trebek.migrate_user_scores(r))
+        self.assertEqual(100, r.zscore(trebek.Trebek.score_board_key.format("2015-09"), 1))
+        self.assertEqual(-50, r.zscore(trebek.Trebek.score_board_key.format("2015-10"), 1))
+        self.assertEqual(55, r.zscore(trebek.Trebek.lifetime_score_board_key, 1))
+        self.assertFalse(r.exists("2015-09-user_score:1"))
+
+    def test_rollup_compacts_closed_months_once(self):
+        r = self.trebek_bot.redis
+        r.zadd(trebek.Trebek.score_board_key.format("2015-09"), {1: 100, 2: -50, 3: 300})
+        r.zadd(trebek.Trebek.score_board_key.format("2015-10"), {1: 200})
+        r.zadd(trebek.Trebek.lifetime_score_board_key, {1: 300, 2: -50, 3: 300})
+
+        self.assertEqual(["2015-09"], trebek.rollup_scores(r, current_month = "2015-10"))
+        self.assertEqual([], trebek.rollup_scores(r, current_month = "2015-10"))
+        self.assertFalse(r.exists(trebek.Trebek.score_board_key.format("2015-09")))
+        self.assertTrue(r.exists(trebek.Trebek.score_board_key.format("2015-10")))
+        self.assertEqual(300, r.zscore(trebek.Trebek.lifetime_score_board_key, 1))
+
+        summary = r.hgetall(trebek.Trebek.score_summary_key.format("2015-09"))
+        self.assertEqual(b"3", summary[b"players"])
+        self.assertEqual(b"350", summary[b"total"])
+        self.assertEqual(b"3", summary[b"high_user"])
+        self.assertEqual(b"-50", summary[b"low_score"])
+
+# The accept/reject cases from test_fuzzy_matching_of_answer, which every
+# similarity backend has to agree on.
+_fuzzy_cases = [
+    ("polygamist", "polyamourus", False),
+    ("<i>Let\\'s Make a Deal</i>", "what is Let's Make a Deal", True),
+    ("<i>Let\\'s Make a Deal</i>", "what is let's make a deal", True),
+    ("<i>Let\\'s Make a Deal</i>", "what is Lets Make a Deal", True),
+    ("<i>Let\\'s Make a Deal</i>", "what is Let's Make Deal", True),
+    ("<i>Let\\'s Make a Deal</i>", "what is Let's Make a Dela", True),
+    ("<i>Let\\'s Make a Deal</i>", "what is Let's Mae a Deal", True),
+    ("<i>Let\\'s Make a Deal</i>", "what is elt's Make a Deal", True),
+    ("a ukulele", "a ukelele", True),
+    ("Scrabble", "Scrablle", True),
+    ("(Aristotle) Onassis", "Onassis", True),
+    ("(William) Blake", "blake", True),
+    ("wings (or feathers)", "feathers", True),
+    ("A.D. (Anno Domini)", "AD", True),
+    ("(Little Orphan) Annie", "annie", True),
+    ("a turtle (or a tortoise)", "turtle", True),
+    ("a turtle (or a tortoise)", "tortoise", True),
+]
+
+class TestSimilarity(unittest.TestCase):
+    def setUp(self):
+        with open('test-room-message.json') as data:
+            d = json.load(data)
+        self.trebek_bot = trebek.Trebek(entities.HipChatRoomMessage(**d), redis_client = _redis)
+        self.trebek_bot.answer_match_ratio = 0.7
+
+    def assert_fuzzy_cases(self, backend):
+        self.trebek_bot.similarity = matching.get_similarity(backend)
+        for expected, actual, correct in _fuzzy_cases:
+            expected = entities.Question(1, answer = expected,
+                    category = get_clue_json()['category']).answer
+            self.assertEqual(correct, self.trebek_bot.is_correct_answer(expected, actual),
+                    "{0}: {1} / {2}".format(backend, expected, actual))
+
+    def test_difflib_backend_accepts_and_rejects_fuzzy_cases(self):
+        self.assert_fuzzy_cases("difflib")
+
+    def test_edit_distance_backend_accepts_and_rejects_fuzzy_cases(self):
+        self.assert_fuzzy_cases("edit_distance")
+
+    def test_difflib_is_the_default_backend(self):
+        self.assertEqual(matching.sequence_matcher_similar, matching.get_similarity())
+
+    def test_difflib_rejects_pairs_the_edit_distance_backend_accepts(self):
+        # at the .env.example ratio, where the two backends disagree
+        for expected, actual in [("boston", "london"), ("paris", "persia")]:
+            self.assertFalse(matching.sequence_matcher_similar(expected, actual, 0.5))
+            self.assertTrue(matching.edit_distance_similar(expected, actual, 0.5))
+
+    def test_bounded_edit_distance_matches_full_distance_within_limit(self):
+        words = ["turtle", "tortoise", "scrabble", "scrablle", "ukulele", "ukelele", "", "a"]
+        for a in words:
+            for b in words:
+                lcs = [[0] * (len(b) + 1) for i in range(len(a) + 1)]
+                for i in range(len(a)):
+                    for j in range(len(b)):
+                        lcs[i + 1][j + 1] = lcs[i][j] + 1 if a[i] == b[j] else max(lcs[i][j + 1], lcs[i + 1][j])
+                full = len(a) + len(b) - 2 * lcs[len(a)][len(b)]
+                for limit in range(0, 6):
+                    expected = full if full <= limit else limit + 1
+                    self.assertEqual(expected, matching.bounded_edit_distance(a, b, limit))
+
 def main():
     unittest.main()
 
@@ -1,18 +1,30 @@
 import redis
 import bs4
 import re
-import difflib
 import time
 import requests
 import json
 import entities
+import clue_source
+import scheduler
+import matching
+import commands
+import cache
+import shards
+import outbox
+import metrics
+import logs
+import periods
+import admission
+import clue_index
+import reports
 from bottle import route, run, template, request, response
 from urllib.parse import urlparse
 import os 
-from threading import Timer
-from datetime import datetime
+from threading import Thread
 
 # trebek jeopardy: starts a round of Jeopardy! trebekbot will pick a category and score for you.
+# trebek jeopardy [category]: starts a round with a clue from the given category.
 # trebek what/who is/are [answer]: sends an answer. Remember, responses must be in the form of a question!
 # trebek score: shows your score for the current month.
 # trebek lifetime score: shows your all-time score.
@@ -29,149 +41,349 @@ _answer_match_ratio = "ANSWER_MATCH_RATIO"
 _secods_to_expire = "SECONDS_TO_EXPIRE"
 _redis_url = "REDIS_URL"
 _hipchat_auth_token = "HIPCHAT_AUTH_TOKEN"
-_timer = None
+_clue_pool_size = "CLUE_POOL_SIZE"
+_clue_pool_low_water = "CLUE_POOL_LOW_WATER"
+_redis_room_urls = "REDIS_ROOM_URLS"
+_seen_clues = "SEEN_CLUES"
+_outbox_workers = "OUTBOX_WORKERS"
+_outbox_max_depth = "OUTBOX_MAX_DEPTH"
+_scheduler = None
+_redis = None
+_room_router = None
+_outbox = None
+_reporter = None
+_http = None
+_user_names = cache.LRUCache(1024, ttl = 300)
+_clock = periods.MonthClock()
 _unit_test = "UNIT_TEST"
+_question_form = re.compile("^(what|whats|where|wheres|who|whos)")
+_log = logs.get_logger("trebek")
+
+# Scores a member on one board and drops the cached rendered top and bottom
+# boards only when the member was or now is inside their visible window. Each
+# drop bumps the board's generation, so that a board rendered from scores read
+# before the change is never cached after it.
+_rescore_lua = """
+local function rescore(board, generation, leaders, losers, member, delta, limit)
+    local was_leader = redis.call('ZREVRANK', board, member)
+    local was_loser = redis.call('ZRANK', board, member)
+    local score = redis.call('ZINCRBY', board, delta, member)
+    if (was_leader and was_leader < limit) or redis.call('ZREVRANK', board, member) < limit then
+        redis.call('DEL', leaders)
+        redis.call('INCR', generation)
+    end
+    if (was_loser and was_loser < limit) or redis.call('ZRANK', board, member) < limit then
+        redis.call('DEL', losers)
+        redis.call('INCR', generation)
+    end
+    return score
+end
+"""
 
-def notify_answer(room_id, clue_id):
-    global _timer
-    _timer.cancel()
-    url = "https://api.hipchat.com/v1/rooms/message?auth_token={1}".format(
-            room_id, os.environ.get(_hipchat_auth_token))
+# KEYS: monthly board, lifetime board, then the monthly and lifetime board
+# generations, rendered leader boards and rendered loser boards. ARGV: user
+# id, score change, board limit.
+_update_score_lua = _rescore_lua + """
+local limit = tonumber(ARGV[3])
+local score = rescore(KEYS[1], KEYS[3], KEYS[4], KEYS[5], ARGV[1], ARGV[2], limit)
+rescore(KEYS[2], KEYS[6], KEYS[7], KEYS[8], ARGV[1], ARGV[2], limit)
+return score
+"""
 
-    key = Trebek.clue_key.format(room_id)
+# Caches a rendered board unless a score change has dropped it since the
+# scores were read. KEYS: rendered board, board generation. ARGV: the
+# generation the scores were read at, the board, seconds to keep it.
+_cache_board_lua = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# Claims an answer on the room's node. KEYS: active clue, user answer, shush,
+# shush answer. ARGV: the clue as the caller read it, user id, outcome
+# (correct, unquestioned, incorrect or expired), clue value, seconds to expire.
+# Comparing the clue with what the caller read means a clue that was answered
+# (or replaced) in the meantime can never score twice. A correct (or expired)
+# answer retires the clue, any other answer is recorded against the user.
+_claim_answer_guard_lua = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return {'gone'}
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return {'answered'}
+end
+"""
+
+_claim_answer_state_lua = """
+if ARGV[3] == 'correct' or ARGV[3] == 'expired' then
+    redis.call('DEL', KEYS[1], KEYS[3])
+    redis.call('SET', KEYS[4], 'true', 'EX', 5)
+else
+    redis.call('SET', KEYS[2], 'true', 'EX', ARGV[5])
+end
+"""
 
-    uri = urlparse(os.environ.get(_redis_url))
-    r = redis.StrictRedis(host = uri.hostname, 
+_claim_answer_lua = _claim_answer_guard_lua + _claim_answer_state_lua + """
+return {ARGV[3]}
+"""
+
+# Claims and scores an answer in one round trip, for when the room's keys and
+# the score boards live on the same node. KEYS and ARGV are those of
+# _claim_answer_lua followed by those of _update_score_lua (less the user id).
+_process_answer_lua = _rescore_lua + _claim_answer_guard_lua + """
+local score = false
+if ARGV[3] ~= 'expired' then
+    local delta = tonumber(ARGV[4])
+    if ARGV[3] ~= 'correct' then
+        delta = -delta
+    end
+    local limit = tonumber(ARGV[6])
+    score = rescore(KEYS[5], KEYS[7], KEYS[8], KEYS[9], ARGV[2], delta, limit)
+    rescore(KEYS[6], KEYS[10], KEYS[11], KEYS[12], ARGV[2], delta, limit)
+end
+""" + _claim_answer_state_lua + """
+return {ARGV[3], score}
+"""
+
+# Pops the first clue in the pool that has not been reported as invalid,
+# dropping any that have. KEYS: clue pool, blocked clue ids. Returns the clue
+# (or nil) and the clues left in the pool.
+_pop_pooled_clue_lua = """
+local clue = false
+while true do
+    local o = redis.call('LPOP', KEYS[1])
+    if not o then
+        break
+    end
+    local record = cjson.decode(o)
+    local id = record[2] or record['id']
+    if redis.call('SISMEMBER', KEYS[2], tostring(id)) == 0 then
+        clue = o
+        break
+    end
+end
+return {clue, redis.call('LLEN', KEYS[1])}
+"""
+
+def connect(url):
+    """ Returns a redis client for url, backed by its own connection pool. """
+    uri = urlparse(url)
+    pool = redis.ConnectionPool(host = uri.hostname,
             port = uri.port, password = uri.password)
-    if r.exists(key):
-        o = r.get(key)
-        obj = entities.Question(**json.loads(o.decode()))
+    return metrics.instrument_redis(redis.StrictRedis(connection_pool = pool))
+
+def get_redis():
+    """ Returns the process-wide redis client, which shares one connection pool. """
+    global _redis
+    if _redis == None:
+        _redis = connect(os.environ.get(_redis_url))
+    return _redis
+
+def get_room_router():
+    """ Maps rooms to the REDIS_ROOM_URLS nodes, or to the REDIS_URL node without them. """
+    global _room_router
+    if _room_router == None:
+        urls = [url.strip() for url in os.environ.get(_redis_room_urls, "").split(',') if url.strip() != ""]
+        if len(urls) == 0:
+            _room_router = shards.ShardRouter([(os.environ.get(_redis_url), get_redis())])
+        else:
+            _room_router = shards.ShardRouter([(url, connect(url)) for url in urls])
+    return _room_router
+
+def get_http():
+    """ Returns the process-wide requests session. """
+    global _http
+    if _http == None:
+        _http = requests.Session()
+    return _http
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler == None:
+        _scheduler = scheduler.ExpirationScheduler(notify_answer, get_redis())
+    return _scheduler
+
+def get_outbox():
+    """ Returns the process-wide HipChat outbox, starting its workers on first use. """
+    global _outbox
+    if _outbox == None:
+        url = "https://api.hipchat.com/v1/rooms/message?auth_token={0}".format(
+                os.environ.get(_hipchat_auth_token))
+        _outbox = outbox.Outbox(get_redis(), get_http(), url,
+                workers = int(os.environ.get(_outbox_workers, 2)),
+                max_depth = int(os.environ.get(_outbox_max_depth, 1000)))
+        _outbox.start()
+    return _outbox
+
+def get_reporter():
+    global _reporter
+    if _reporter == None:
+        _reporter = reports.InvalidClueReporter(get_http())
+    return _reporter
+
+def notify_answer(room_id, clue_id):
+    key = Trebek.clue_key.format(room_id)
+
+    r = get_room_router().client_for(room_id)
+    o = r.get(key)
+    if o != None:
+        obj = entities.decode_clue(o)
         if obj.id == clue_id:
             r.delete(key)
-            parameters = {}
-            parameters['message'] = "The answer was: {0}".format(obj.answer)
-            parameters['room_id'] = room_id
-            parameters['color'] = 'gray'
-            parameters['from'] = 'Trebek'
-            resp = requests.post(url, data = parameters, timeout=5)
-            if resp.status_code != 200:
-                print('failed to post message to hipchat')
+            get_outbox().send(room_id, "The answer was: {0}".format(obj.answer))
     else:
-        print('no redis key exists, do not notify')
+        _log.debug("no active clue in room %s, not notifying", room_id)
+
+class RoomState(object):
+    """ A room's game state as read by Trebek.get_room_state. """
+    __slots__ = ('raw_clue', 'shushed', 'answer_shushed', '_active_clue')
+
+    def __init__(self, raw_clue, shushed, answer_shushed):
+        self.raw_clue = raw_clue
+        self.shushed = bool(shushed)
+        self.answer_shushed = bool(answer_shushed)
+        self._active_clue = None
+
+    @property
+    def active_clue(self):
+        if self._active_clue == None and self.raw_clue != None:
+            self._active_clue = entities.decode_clue(self.raw_clue)
+        return self._active_clue
 
 class Trebek:
-    clue_key = "activeClue:{0}"
+    router = commands.CommandRouter()
+    # room keys carry the room id as a hash tag, {room}, so that all of a
+    # room's keys land on one node and can be used together in a script
+    clue_key = "activeClue:{{{0}}}"
     hipchat_user_key = "hipchat_user:{0}"
+    hipchat_users_key = "hipchat_users"
     user_score_prefix_base = "user_score"
-    shush_key = "shush:{0}"
-    shush_answer_key = "shush:answer:{0}"
-    user_answer_key = "user_answer:{0}:{1}:{2}"
+    score_board_key = "user_scores:{0}"
+    lifetime_score_board_key = "user_scores:lifetime"
+    rendered_board_key = "rendered_board:{0}:{1}"
+    board_generation_key = "rendered_board:{0}:generation"
+    rendered_board_ttl = 24 * 60 * 60
+    score_summary_key = "score_summary:{0}"
+    shush_key = "shush:{{{0}}}"
+    shush_answer_key = "shush:answer:{{{0}}}"
+    user_answer_key = "user_answer:{{{0}}}:{1}:{2}"
+    clue_pool_key = "cluePool"
+    clue_pool_lock_key = "cluePool:refill"
+    blocked_clues_key = "cluesBlocked"
+    seen_clues_key = "cluesSeen"
+    room_seen_clues_key = "cluesSeen:{{{0}}}"
     board_limit = int(os.environ.get(_board_limit))
     answer_match_ratio = float(os.environ.get(_answer_match_ratio))
     seconds_to_expire = int(os.environ.get(_secods_to_expire))
+    similarity = staticmethod(matching.get_similarity())
+    clue_pool_size = int(os.environ.get(_clue_pool_size, 50))
+    clue_pool_low_water = int(os.environ.get(_clue_pool_low_water, 10))
+    seen_clues = os.environ.get(_seen_clues, "global")
+    seen_attempts = 10
+    fetch_attempts = 10
 
     @property
-    def user_score_prefix(self):
-        return "{0}-{1}".format(self.get_year_month(), self.user_score_prefix_base)
+    def score_board(self):
+        return self.score_board_key.format(self.get_year_month())
 
-    def __init__(self, room_message = None):
-        uri = urlparse(os.environ.get(_redis_url))
-        self.redis = redis.StrictRedis(host = uri.hostname, 
-                port = uri.port, password = uri.password)
+    def __init__(self, room_message = None, redis_client = None, user_names = None,
+            room_redis_client = None, clock = None, reporter = None):
+        """ room_redis_client holds the room's state, redis_client everything else. """
         self.room_message = room_message
         self.room_id = self.room_message.item.room.room_id
+        self.redis = redis_client if redis_client != None else get_redis()
+        if room_redis_client != None:
+            self.room_redis = room_redis_client
+        elif redis_client != None:
+            self.room_redis = redis_client
+        else:
+            self.room_redis = get_room_router().client_for(self.room_id)
+        self.user_names = user_names if user_names != None else _user_names
+        self.clock = clock if clock != None else _clock
+        self.reporter = reporter if reporter != None else get_reporter()
+        self.clue_source = clue_source.get_clue_source(get_http())
+        self.clue_index = clue_index.ClueIndex(self.redis)
 
     def get_year_month(self):
-        now = datetime.now()
-        return "{0}-{1}".format(now.year, str(now.month).zfill(2))
+        return self.clock.key
 
     def get_active_clue(self):
-        key = self.clue_key.format(self.room_id)
-        obj = None
-        if self.redis.exists(key):
-            o = self.redis.get(key)
-            obj = entities.Question(**json.loads(o.decode()))
+        o = self.room_redis.get(self.clue_key.format(self.room_id))
+        return entities.decode_clue(o) if o != None else None
 
-        return obj
+    def get_room_state(self):
+        """ Reads the active clue and shush flags in one round trip. """
+        pipe = self.room_redis.pipeline()
+        pipe.get(self.clue_key.format(self.room_id))
+        pipe.exists(self.shush_key.format(self.room_id))
+        pipe.exists(self.shush_answer_key.format(self.room_id))
+        return RoomState(*pipe.execute())
 
     def get_response_message(self):
         cmd = self.room_message.item.message.message
         self.save_hipchat_user()
-        print("cmd - {0}".format(cmd))
-        if re.match('^jeopardy*', cmd):
-            response = self.get_question()
-        elif re.match('^lifetime score$', cmd):
-            response = self.get_user_score(lifetime = True)
-        elif re.match('^score$', cmd):
-            response = self.get_user_score()
-        elif re.match('^help$', cmd):
-            response = self.get_help()
-        elif re.match('^answer$', cmd):
-            response = self.get_answer()
-        elif re.match('^(show\s+)?(me\s+)?(the\s+)?(lifetime\s+)leaderboard$', cmd):
-            response = self.get_leaderboard(lifetime = True)
-        elif re.match('^(show\s+)?(me\s+)?(the\s+)?leaderboard$', cmd):
-            response = self.get_leaderboard()
-        elif re.match('^(show\s+)?(me\s+)?(the\s+)?(lifetime\s+)loserboard$', cmd):
-            response = self.get_loserboard(lifetime = True)
-        elif re.match('^(show\s+)?(me\s+)?(the\s+)?loserboard$', cmd):
-            response = self.get_loserboard()
-        elif re.match('^invalid', cmd):
-            response = self.post_clue_invalid()
-        else:
-            response = self.process_answer()
-
-        return response
+        _log.debug("cmd - %s", cmd)
+        handler, kwargs = self.router.route(cmd)
+        with metrics.command_seconds.time(command = handler):
+            return getattr(self, handler)(**kwargs)
 
+    @router.command(r'^invalid')
     def post_clue_invalid(self):
+        """ Blocks the active clue everywhere and reports it in the background. """
         clue = self.get_active_clue()
-        url = "http://jservice.io/api/invalid?id={0}".format(clue.id)
-        resp = requests.post(url)
-        response = "Failed to Post Invalid Question"
-        if resp.status_code == 200:
-            response = "Submitted question as invalid. Invalid Count: {0}".format(resp.json()['invalid_count']) 
+        if clue == None:
+            return "No active clue. Type '/trebek jeopardy' to start a round"
 
-        return response
+        self.redis.sadd(self.blocked_clues_key, clue.id)
+        self.reporter.report(clue.id)
+        return "Submitted question as invalid. It will not be asked again."
 
+    @router.command(r'^lifetime score$', lifetime = True)
+    @router.command(r'^score$')
     def get_user_score(self, lifetime = False):
-        pattern = "*{0}:{1}".format(
-                self.user_score_prefix_base if lifetime else self.user_score_prefix, 
-                self.room_message.item.message.user_from.id)
-        score = 0
-        for score_key in self.redis.scan_iter(match = pattern):
-            score += int(self.redis.get(score_key).decode())
-        
-        return self.format_currency(score)
+        key = self.lifetime_score_board_key if lifetime else self.score_board
+        score = self.redis.zscore(key, self.room_message.item.message.user_from.id)
+        return self.format_currency(score or 0)
 
     def save_hipchat_user(self):
-        key = self.hipchat_user_key.format(self.room_message.item.message.user_from.id)
-        if not self.redis.exists(key):
-            self.redis.set(key, self.room_message.item.message.user_from.name)
-
-    def get_question(self):
+        """ Registers the user's name, once per process. """
+        user = self.room_message.item.message.user_from
+        if self.user_names.get(str(user.id)) == None:
+            self.redis.hsetnx(self.hipchat_users_key, user.id, user.name)
+            self.user_names.set(str(user.id), user.name)
+
+    @router.command(r'^jeopardy*(\s+(?!me\s*$)(?P<category>\S.*))?')
+    def get_question(self, category = None):
         message = ""
         key = self.clue_key.format(self.room_id) 
         shush_key = self.shush_key.format(self.room_id)
-        if not self.redis.exists(shush_key):
-            if self.redis.exists(key):
-                active_clue = self.get_active_clue()
-                message = "The answer was: <b>{0}</b><br/>".format(active_clue.answer)
-            clue = self.get_jeopardy_clue()
+        state = self.get_room_state()
+        if not state.shushed:
+            clue = self.get_jeopardy_clue(category.strip() if category != None else None)
+            if clue == None and category != None:
+                return "I don't know any new clues in the category <b>{0}</b> yet.".format(category.strip().upper())
+            elif clue == None:
+                return "I don't have any clues to ask right now. Try again later."
+            if state.active_clue != None:
+                message = "The answer was: <b>{0}</b><br/>".format(state.active_clue.answer)
             message += "The category is <b>{0}</b> for {1}: <b>{2}</b> (Air Date: {3:%d-%b-%Y)}".format(
                     clue.category.title.upper(), self.format_currency(clue.value), clue.question.upper(),
                     clue.airdate)
             
-            pipe = self.redis.pipeline()
-            pipe.set(key, json.dumps(clue, cls=entities.QuestionEncoder))
+            # warm the answer matcher while the clue is stored
+            matching.get_matcher(clue.answer)
+            pipe = self.room_redis.pipeline()
+            pipe.set(key, entities.encode_clue(clue))
             pipe.setex(shush_key, 5, 'true')
             pipe.execute()
             if not os.environ.get(_unit_test):
-                global _timer
-                _timer = Timer(self.seconds_to_expire + 5, notify_answer, args = [self.room_id, clue.id])
-                _timer.start()
+                get_scheduler().schedule(clue.expiration + 5, self.room_id, clue.id)
              
         return message
 
+    @router.command(r'^answer$')
     def get_answer(self):
         clue = self.get_active_clue()
         if clue == None:
@@ -181,186 +393,279 @@ class Trebek:
             self.mark_question_as_answered()
         return response
 
+    @router.default_command
     def process_answer(self):
         """ Command that will parse and process any response from the user.
         """
-        key = self.clue_key.format(self.room_id) 
-        shush_answer = self.shush_answer_key.format(self.room_id)
-        clue = self.get_active_clue()
-        if clue == None and not self.redis.exists(shush_answer):
+        state = self.get_room_state()
+        if state.raw_clue == None and not state.answer_shushed:
             return self.trebek_me()
-        elif clue == None:
+        elif state.raw_clue == None:
             return None
 
-        response = ""
+        clue = state.active_clue
         user_answer = self.room_message.item.message.message
         correct_answer = self.is_correct_answer(clue.answer, user_answer)
-        user_answer_key = self.user_answer_key.format(self.room_id,
-                clue.id, self.room_message.item.message.user_from.id)
+        if clue.expiration < time.time():
+            outcome = "expired"
+        elif self.response_is_a_question(user_answer) and correct_answer:
+            outcome = "correct"
+        elif correct_answer:
+            outcome = "unquestioned"
+        else:
+            outcome = "incorrect"
 
+        result = self.settle_answer(state.raw_clue, clue, outcome)
         hipchat_user_name = self.room_message.item.message.user_from.name
-        if self.redis.exists(user_answer_key):
+        if result[0] == b"gone":
+            response = None
+        elif result[0] == b"answered":
             response = "You have already answered {0}. Let someone else respond.".format(hipchat_user_name)
-        elif clue.expiration < time.time():
-            if correct_answer:
-                response = "That is correct {0}, however time is up. (Expected Answer: {1})".format(hipchat_user_name, clue.answer)
-            else:
-                response = "Time is up! The correct answer was: <b>{0}</b>".format(clue.answer)
-            self.mark_question_as_answered()
-        elif self.response_is_a_question(user_answer) and correct_answer:
-            score = self.update_score(clue.value)
+        elif outcome == "expired" and correct_answer:
+            response = "That is correct {0}, however time is up. (Expected Answer: {1})".format(hipchat_user_name, clue.answer)
+        elif outcome == "expired":
+            response = "Time is up! The correct answer was: <b>{0}</b>".format(clue.answer)
+        elif outcome == "correct":
             response = "That is correct, {0}. Your score is now {1} (Expected Answer: {2})".format(
-                    hipchat_user_name, self.format_currency(score), clue.answer)
-            self.mark_question_as_answered()
-        elif correct_answer:
-            score = self.update_score(-clue.value)
+                    hipchat_user_name, self.format_currency(float(result[1])), clue.answer)
+        elif outcome == "unquestioned":
             response = "That is correct {0}, however responses should be in the form of a question.".format(hipchat_user_name)
-            response += " Your score is now {0}".format(self.format_currency(score))
-            clue.expiration = time.time() + self.seconds_to_expire
-            self.redis.setex(user_answer_key, self.seconds_to_expire, 'true')
+            response += " Your score is now {0}".format(self.format_currency(float(result[1])))
         else:
-            score = self.update_score(-clue.value)
-            response = "That is incorrect, {0}. Your score is now {1}".format(hipchat_user_name, self.format_currency(score))
-            clue.expiration = time.time() + self.seconds_to_expire
-            self.redis.setex(user_answer_key, self.seconds_to_expire, 'true')
+            response = "That is incorrect, {0}. Your score is now {1}".format(
+                    hipchat_user_name, self.format_currency(float(result[1])))
 
         return response
-        
+
+    def settle_answer(self, raw_clue, clue, outcome):
+        """ Atomically claims the answer on the room's node and scores it. """
+        user_id = self.room_message.item.message.user_from.id
+        keys = [self.clue_key.format(self.room_id),
+                self.user_answer_key.format(self.room_id, clue.id, user_id),
+                self.shush_key.format(self.room_id), self.shush_answer_key.format(self.room_id)]
+        args = [raw_clue, user_id, outcome, clue.value, self.seconds_to_expire]
+        if self.room_redis is self.redis:
+            script = self.redis.register_script(_process_answer_lua)
+            return script(keys = keys + self.score_keys(), args = args + [self.board_limit])
+
+        # the room lives on another node: claim the answer there, then score it
+        script = self.room_redis.register_script(_claim_answer_lua)
+        result = script(keys = keys, args = args)
+        if result[0].decode() == outcome and outcome != "expired":
+            result.append(self.update_score(clue.value if outcome == "correct" else -clue.value))
+        return result
+
     def mark_question_as_answered(self):
-        pipe = self.redis.pipeline()
+        pipe = self.room_redis.pipeline()
         pipe.delete(self.clue_key.format(self.room_id))
         pipe.delete(self.shush_key.format(self.room_id))
         pipe.setex(self.shush_answer_key.format(self.room_id), 5, 'true')
         pipe.execute()
 
     def update_score(self, score = 0):
-        key = "{0}:{1}".format(self.user_score_prefix, self.room_message.item.message.user_from.id)
-        old_score = 0
-        if self.redis.exists(key):
-            old_score = int(self.redis.get(key))
-
-        new_score = old_score + score
-        self.redis.set(key, new_score)
-        return new_score
-
-    def get_jeopardy_clue(self):
-        key = self.clue_key.format(self.room_id)
-        clue = self.fetch_random_clue()
-        while not self.is_valid_clue(clue):
-            clue = self.fetch_random_clue()
-        clue.expiration = time.time() + self.seconds_to_expire
+        user_id = self.room_message.item.message.user_from.id
+        script = self.redis.register_script(_update_score_lua)
+        new_score = script(keys = self.score_keys(), args = [user_id, score, self.board_limit])
+        return int(float(new_score))
+
+    def score_keys(self):
+        """ The keys the score scripts expect, in order. """
+        month = self.get_year_month()
+        keys = [self.score_board_key.format(month), self.lifetime_score_board_key]
+        for period in (month, "lifetime"):
+            keys += [self.board_generation_key.format(period),
+                    self.rendered_board_key.format(period, "leaders"), self.rendered_board_key.format(period, "losers")]
+        return keys
+
+    def get_jeopardy_clue(self, category = None):
+        """ Returns the next unplayed clue, or None when there is none to ask. """
+        clue = None
+        for attempt in range(self.seen_attempts):
+            if category != None:
+                candidate = self.clue_index.random_clue(category = category)
+                if candidate != None and self.is_blocked(candidate):
+                    continue
+            else:
+                candidate = self.pop_pooled_clue() or self.fetch_valid_clue()
+            if candidate == None:
+                break
+            if self.mark_clue_seen(candidate):
+                clue = candidate
+                break
+            if category == None:
+                # a deployment that has played nearly every clue repeats one
+                # rather than never starting the round
+                clue = candidate
+
+        if clue != None:
+            clue.expiration = time.time() + self.seconds_to_expire
         return clue
 
+    def fetch_valid_clue(self):
+        """ Fetches a valid clue, or returns None after fetch_attempts tries. """
+        for attempt in range(self.fetch_attempts):
+            clue = self.fetch_random_clue()
+            if clue == None:
+                return None
+            if self.is_valid_clue(clue):
+                self.clue_index.add([clue])
+                return clue
+        return None
+
+    def mark_clue_seen(self, clue):
+        """ Sets the clue's seen bit; returns False if it was already played. """
+        if self.seen_clues == "off":
+            return True
+        elif self.seen_clues == "room":
+            return self.room_redis.setbit(self.room_seen_clues_key.format(self.room_id), clue.id, 1) == 0
+        return self.redis.setbit(self.seen_clues_key, clue.id, 1) == 0
+
+    def pop_pooled_clue(self):
+        """ Pops a clue from the shared pool, refilling it when it runs low. """
+        script = self.redis.register_script(_pop_pooled_clue_lua)
+        o, remaining = script(keys = [self.clue_pool_key, self.blocked_clues_key])
+        if remaining < self.clue_pool_low_water and not os.environ.get(_unit_test):
+            Thread(target = self.refill_clue_pool, daemon = True).start()
+
+        if o == None:
+            return None
+        return entities.decode_clue(o)
+
+    def refill_clue_pool(self):
+        """ Fills the clue pool with valid, unplayed clues. """
+        if not self.redis.set(self.clue_pool_lock_key, 'true', nx = True, ex = 30):
+            return 0
+
+        added = 0
+        try:
+            needed = self.clue_pool_size - self.redis.llen(self.clue_pool_key)
+            attempts = 0
+            while needed > added and attempts < 3:
+                attempts += 1
+                clues = self.playable_clues([c for c in self.fetch_random_clues(needed - added)
+                        if clue_source.is_valid_clue(c)])
+                if len(clues) > 0:
+                    pipe = self.redis.pipeline()
+                    pipe.rpush(self.clue_pool_key, *[entities.encode_clue(c) for c in clues])
+                    self.clue_index.add(clues, pipe)
+                    pipe.execute()
+                    added += len(clues)
+        except requests.RequestException as e:
+            _log.warning("failed to refill clue pool: %s", e)
+        finally:
+            self.redis.delete(self.clue_pool_lock_key)
+
+        return added
+
     def is_valid_clue(self, clue):
-        valid = clue.invalid_count == None and clue.question.strip() != ""
-        if valid:
-            valid = "seen here" not in clue.question.lower()
+        return clue_source.is_valid_clue(clue) and not self.is_blocked(clue)
 
-        if valid:
-            valid = "heard here" not in clue.question.lower()
+    def is_blocked(self, clue):
+        return self.redis.sismember(self.blocked_clues_key, clue.id)
 
-        return valid
+    def playable_clues(self, clues):
+        """ Drops blocked and (with SEEN_CLUES=global) played clues in one round trip. """
+        if len(clues) == 0:
+            return []
+        check_seen = self.seen_clues == "global"
+        pipe = self.redis.pipeline()
+        for clue in clues:
+            pipe.sismember(self.blocked_clues_key, clue.id)
+            if check_seen:
+                pipe.getbit(self.seen_clues_key, clue.id)
+        results = pipe.execute()
+        step = 2 if check_seen else 1
+        return [clue for i, clue in enumerate(clues) if not any(results[i * step:(i + 1) * step])]
 
     def fetch_random_clue(self):
-        url = "http://jservice.io/api/random?count=1"
-        req = requests.get(url)
-        # print(req.json())
-        print("ANSWER: {0}".format(req.json()[0]['answer']))
-        return entities.Question(**req.json()[0])
+        clues = self.fetch_random_clues(1)
+        if len(clues) == 0:
+            return None
+        _log.debug("ANSWER: %s", clues[0].answer)
+        return clues[0]
 
-    def response_is_a_question(self, response):
-        return re.match("^(what|whats|where|wheres|who|whos)", response.lower().strip())
+    def fetch_random_clues(self, count):
+        with metrics.clue_fetch_seconds.time():
+            return self.clue_source.random_clues(count)
 
-    def clean_expected_answer(self, expected):
-        expected = re.sub(r'[^\w\s]', "", expected, flags=re.I)
-        expected = re.sub(r'^(the|a|an|or) ', "", expected, flags=re.I)
-        return expected.strip().lower()
+    def response_is_a_question(self, response):
+        return _question_form.match(response.lower().strip())
 
     def compare_answers(self, expected, actual):
-        seq = difflib.SequenceMatcher(a = expected, b = actual)
-        print("Expected: {0} - Actual: {1} - Ratio: {2}".format(expected, actual, seq.ratio()))
-        return seq.ratio() >= self.answer_match_ratio
+        with metrics.match_seconds.time():
+            similar = self.similarity(expected, actual, self.answer_match_ratio)
+        _log.debug("Expected: %s - Actual: %s - Match: %s", expected, actual, similar)
+        return similar
 
     def is_correct_answer(self, expected, actual):
-        expected_orig = expected
-        expected = self.clean_expected_answer(expected)
-        expected = expected.strip().lower()
-
-        actual = re.sub(r'\s+(&nbsp;|&)\s+', " and ", actual, flags=re.I)
-        actual = re.sub(r'[^\w\s]', "", actual, flags=re.I) 
-        actual = re.sub(r'^(what|whats|where|wheres|who|whos) ', "", actual, flags=re.I) 
-        actual = re.sub(r'^(is|are|was|were) ', "", actual, flags=re.I) 
-        actual = re.sub(r'^(the|a|an) ', "", actual, flags=re.I) 
-        actual = re.sub(r'\?+$/', "", actual, flags=re.I) 
-        actual = actual.strip().lower()
-
-        is_correct = self.compare_answers(expected, actual)
-        if not is_correct:
-            # see unit tests for examples. Handles answers with "this (or that)" structure
-            parens_group = re.match(r"(.*)(\(.+\))(.*)", expected_orig)
-            if parens_group:
-                # if there is an alternate, compare alternate answer
-                if "or" in parens_group.group(2):
-                    expected = self.clean_expected_answer(parens_group.group(2))
-                    is_correct = self.compare_answers(expected, actual)
-
-                if not is_correct:
-                    expected = self.clean_expected_answer(expected_orig.replace(parens_group.group(2), ""))
-                    is_correct = self.compare_answers(expected, actual)
-
-        return is_correct
+        return matching.get_matcher(expected).matches(actual, self.compare_answers)
 
     def get_user_name(self, user_id):
-        key = self.hipchat_user_key.format(user_id)
-        return self.redis.get(key).decode()
-
-    def get_scores(self, lifetime = False):
-        scores = {}
-        pattern = "*{0}:*".format(
-                self.user_score_prefix_base if lifetime else self.user_score_prefix)
-
-        for score_key in self.redis.scan_iter(match=pattern):
-            user_id = score_key.decode().split(':')[1]
-            previous_score = 0
-            if user_id in scores.keys():
-                previous_score = scores[user_id]
-            scores[user_id] = int(self.redis.get(score_key).decode()) + previous_score
+        return self.get_user_names([user_id])[0]
+
+    def get_user_names(self, user_ids):
+        """ Looks up user names from the cache, then with a single HMGET. """
+        names = [self.user_names.get(str(user_id)) for user_id in user_ids]
+        missing = [user_id for user_id, name in zip(user_ids, names) if name == None]
+        if len(missing) > 0:
+            fetched = dict(zip(missing, self.redis.hmget(self.hipchat_users_key, missing)))
+            for i, user_id in enumerate(user_ids):
+                if names[i] == None and fetched[user_id] != None:
+                    names[i] = fetched[user_id].decode()
+                    self.user_names.set(str(user_id), names[i])
+                elif names[i] == None:
+                    names[i] = str(user_id)
+        return names
+
+    def get_scores(self, lifetime = False, losers = False):
+        """ Returns the board_limit (user_id, score) pairs to display. """
+        key = self.lifetime_score_board_key if lifetime else self.score_board
+        if losers:
+            scores = self.redis.zrange(key, 0, self.board_limit - 1, withscores = True)
+        else:
+            scores = self.redis.zrevrange(key, 0, self.board_limit - 1, withscores = True)
 
-        return scores
+        return [(user_id.decode(), int(score)) for user_id, score in scores]
 
+    @router.command(r'^(show\s+)?(me\s+)?(the\s+)?(lifetime\s+)loserboard$', lifetime = True)
+    @router.command(r'^(show\s+)?(me\s+)?(the\s+)?loserboard$')
     def get_loserboard(self, lifetime = False):
-        sorted_losers = sorted(self.get_scores(lifetime).items(), key=lambda x: int(x[1]))
-        loserboard = ""
-        if not lifetime:
-            year, month = [int(x) for x in self.get_year_month().split('-')]
-            dt = datetime(year, month, 1)
-            loserboard = "<p>Loserboard for {0} {1}:</p>".format(dt.strftime("%B"), year)
-        loserboard += self.get_formatted_board(sorted_losers)
-        return loserboard
+        return self.get_board(lifetime, losers = True)
 
+    @router.command(r'^(show\s+)?(me\s+)?(the\s+)?(lifetime\s+)leaderboard$', lifetime = True)
+    @router.command(r'^(show\s+)?(me\s+)?(the\s+)?leaderboard$')
     def get_leaderboard(self, lifetime = False):
-        sorted_leaders = sorted(self.get_scores(lifetime).items(), reverse = True, key=lambda x: int(x[1]))
-        leaderboard = ""
+        return self.get_board(lifetime)
+
+    def get_board(self, lifetime = False, losers = False):
+        """ Returns the rendered board, cached until a visible score changes. """
+        period, label = ("lifetime", None) if lifetime else self.clock.current()[:2]
+        key = self.rendered_board_key.format(period, "losers" if losers else "leaders")
+        generation_key = self.board_generation_key.format(period)
+        pipe = self.redis.pipeline()
+        pipe.get(key)
+        pipe.get(generation_key)
+        board, generation = pipe.execute()
+        if board != None:
+            return board.decode()
+
+        board = ""
         if not lifetime:
-            year, month = [int(x) for x in self.get_year_month().split('-')]
-            dt = datetime(year, month, 1)
-            leaderboard = "<p>Leaderboard for {0} {1}:</p>".format(dt.strftime("%B"), year)
-        leaderboard += self.get_formatted_board(sorted_leaders)
-        return leaderboard
+            board = "<p>{0} for {1}:</p>".format("Loserboard" if losers else "Leaderboard", label)
+        board += self.get_formatted_board(self.get_scores(lifetime, losers))
+        script = self.redis.register_script(_cache_board_lua)
+        script(keys = [key, generation_key], args = [generation or '', board, self.rendered_board_ttl])
+        return board
 
     def get_formatted_board(self, sorted_board):
         if len(sorted_board) == 0:
             return "No results for current month"
 
-        board = "<ol>"
-        for i, user in enumerate(sorted_board):
-            board += '<li>{0}: {1}</li>'.format(self.get_user_name(user[0]), self.format_currency(user[1]))
-            if i + 1 >= self.board_limit: break
-
-        board += "</ol>"
+        names = self.get_user_names([user_id for user_id, score in sorted_board])
+        rows = ['<li>{0}: {1}</li>'.format(name, self.format_currency(score))
+                for name, (user_id, score) in zip(names, sorted_board)]
+        return "<ol>{0}</ol>".format("".join(rows))
 
-        return board
-            
     def format_currency(self, string_value):
         prefix = "$"
         score = int(string_value)
@@ -424,9 +729,11 @@ class Trebek:
         import random
         return random.sample(quotes, 1)[0].format(self.room_message.item.message.user_from.name)
 
+    @router.command(r'^help$')
     def get_help(self):
         return """<ul>
 <li>/trebek jeopardy: starts a round of Jeopardy! trebekbot will pick a category and score for you.</li>
+<li>/trebek jeopardy [category]: starts a round with a clue from the given category, out of the clues trebekbot has seen so far.</li>
 <li>/trebek what/who is/are [answer]: sends an answer. Remember, responses must be in the form of a question!</li>
 <li>/trebek score: shows your score for the current month.</li>
 <li>/trebek lifetime score: shows your all-time score.</li>
@@ -440,6 +747,89 @@ class Trebek:
 </ul>
 """
 
+def migrate_user_scores(r):
+    """ Folds the legacy per-user score keys into the sorted sets. """
+    migrated = 0
+    pattern = "*{0}:*".format(Trebek.user_score_prefix_base)
+    month_suffix = "-{0}".format(Trebek.user_score_prefix_base)
+    for key in r.scan_iter(match = pattern):
+        prefix, user_id = key.decode().split(':', 1)
+        value = r.get(key)
+        if value == None:
+            continue
+
+        score = int(value)
+        pipe = r.pipeline()
+        month = "lifetime"
+        if prefix.endswith(month_suffix):
+            month = prefix[:-len(month_suffix)]
+            pipe.zincrby(Trebek.score_board_key.format(month), score, user_id)
+        pipe.zincrby(Trebek.lifetime_score_board_key, score, user_id)
+        pipe.delete(key, *[Trebek.rendered_board_key.format(period, board)
+            for period in (month, "lifetime") for board in ("leaders", "losers")])
+        for period in (month, "lifetime"):
+            pipe.incr(Trebek.board_generation_key.format(period))
+        pipe.execute()
+        migrated += 1
+
+    return migrated
+
+_month_board = re.compile(r'^user_scores:(\d{4}-\d{2})$')
+
+def rollup_scores(r, current_month = None, summary = True):
+    """ Replaces closed monthly boards with score summaries; returns the months. """
+    if current_month == None:
+        current_month = _clock.key
+
+    rolled_up = []
+    for key in r.scan_iter(match = Trebek.score_board_key.format("*")):
+        key = key.decode()
+        match = _month_board.match(key)
+        if match == None or match.group(1) >= current_month:
+            continue
+
+        month = match.group(1)
+        with r.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                scores = pipe.zrange(key, 0, -1, withscores = True)
+                if len(scores) == 0:
+                    continue
+                pipe.multi()
+                if summary:
+                    low_user, low_score = scores[0]
+                    high_user, high_score = scores[-1]
+                    pipe.hset(Trebek.score_summary_key.format(month), mapping = {
+                        "players": len(scores),
+                        "total": int(sum(score for user_id, score in scores)),
+                        "high_user": high_user, "high_score": int(high_score),
+                        "low_user": low_user, "low_score": int(low_score)})
+                pipe.delete(key, Trebek.rendered_board_key.format(month, "leaders"),
+                        Trebek.rendered_board_key.format(month, "losers"),
+                        Trebek.board_generation_key.format(month))
+                pipe.execute()
+                rolled_up.append(month)
+            except redis.WatchError:
+                # the board changed while it was being read; the next run picks it up
+                continue
+
+    return sorted(rolled_up)
+
+def migrate_user_names(r):
+    """ Moves the legacy hipchat_user:<id> keys into the hipchat_users hash. """
+    migrated = 0
+    for key in r.scan_iter(match = Trebek.hipchat_user_key.format("*")):
+        user_id = key.decode().split(':', 1)[1]
+        name = r.get(key)
+        if name != None:
+            pipe = r.pipeline()
+            pipe.hsetnx(Trebek.hipchat_users_key, user_id, name)
+            pipe.delete(key)
+            pipe.execute()
+            migrated += 1
+
+    return migrated
+
 @route ("/", method='POST')
 def index():
     # print("REQUEST: {0}".format(request.json))
@@ -453,15 +843,43 @@ def index():
 
     msg = entities.HipChatRoomMessage(**request.json)
     trebek = Trebek(msg)
-    response_message = trebek.get_response_message()
+    # retries and spam are turned away before any clue fetch or score write
+    gate = admission.Admission(trebek.room_redis)
+    decision, body = gate.admit(msg)
+    if decision == "duplicate":
+        return body
+    elif decision == "limited":
+        return ""
+
+    body = ""
+    try:
+        response_message = trebek.get_response_message()
+    except Exception:
+        gate.forget(msg)
+        raise
     if response_message != None:
         parameters = {}
         parameters['from'] = 'trebek'
         parameters['room_id'] = msg.item.room.room_id 
         parameters['message'] = response_message
         parameters['color'] = 'gray'
-
-        return json.dumps(parameters)
+        body = json.dumps(parameters)
+
+    gate.remember(msg, body)
+    return body
+
+@route ("/outbox", method='GET')
+def outbox_stats():
+    response.content_type = 'application/json'
+    return json.dumps(get_outbox().stats())
+
+@route ("/metrics", method='GET')
+def metrics_endpoint():
+    if _outbox != None:
+        for name, value in _outbox.stats().items():
+            metrics.outbox_gauge.set(value, stat = name)
+    response.content_type = 'text/plain; version=0.0.4'
+    return metrics.registry.render()
 
 if __name__ == "__main__":
     run (host='localhost', port=8080, reloader=True, server='paste')